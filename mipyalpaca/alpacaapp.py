@@ -0,0 +1,153 @@
+import uasyncio
+import utime
+from microdot import MUTED_SOCKET_ERRORS
+from microdot_asyncio import Microdot, Request, Response
+from mipyalpaca.alpacalog import log, LOG_DEBUG
+from mipyalpaca.alpacagc import gcManager
+
+
+# reply to connections over capacity (sent without reading the request)
+REPLY_503 = b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n"
+
+
+# Stream reader that limits the total size of request line and headers
+class HeaderLimitReader:
+
+    def __init__(self, reader, limit):
+        self.reader = reader
+        self.remaining = limit   # header bytes still allowed
+
+    async def readline(self):
+        line = await self.reader.readline()
+        self.remaining -= len(line)
+        if self.remaining < 0:
+            raise ValueError("Request header too large")
+        return line
+
+    async def readexactly(self, n):
+        return await self.reader.readexactly(n)
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+
+# Microdot application with admission control
+# limits the number of concurrently handled connections, queues a bounded number of
+# further connections and rejects the rest early with a static 503 reply;
+# request size and the time to receive a request are limited
+class AlpacaApp(Microdot):
+
+    def __init__(self):
+        super().__init__()
+        self.maxConnections = 4     # connections handled concurrently
+        self.acceptQueue = 4        # connections waiting for a free slot
+        self.requestTimeout = 5000  # time to receive the request in ms
+        self.queueTimeout = 5000    # time to wait in the queue for a free slot in ms
+        self.maxHeaderSize = 2048   # size of request line and headers in bytes
+        self.active = 0             # connections being handled
+        self.waiting = 0            # connections waiting for a free slot
+        self.lastActivity = utime.ticks_ms()  # time the last connection was finished
+        self.slotFree = uasyncio.Event()  # set when a connection has been finished
+        self.accepted = 0           # handled connections
+        self.rejected = 0           # connections rejected with 503
+        self.timeouts = 0           # connections closed because the request was not received in time
+
+
+    # apply server configuration
+    def configure(self, config):
+        self.maxConnections = int(config.get("maxConnections", self.maxConnections))
+        self.acceptQueue = int(config.get("acceptQueue", self.acceptQueue))
+        self.requestTimeout = int(config.get("requestTimeout", self.requestTimeout))
+        self.queueTimeout = int(config.get("queueTimeout", self.queueTimeout))
+        self.maxHeaderSize = int(config.get("maxHeaderSize", self.maxHeaderSize))
+        maxbody = int(config.get("maxBodySize", 4096))
+        Request.max_content_length = maxbody
+        Request.max_body_length = maxbody
+        Request.max_readline = min(Request.max_readline, self.maxHeaderSize)
+
+
+    # wait for a free connection slot, returns False if none became free in time
+    async def admit(self):
+        if self.active < self.maxConnections:
+            return True
+        if self.waiting >= self.acceptQueue:
+            return False
+        self.waiting += 1
+        try:
+            t0 = utime.ticks_ms()
+            while self.active >= self.maxConnections:
+                wait = self.queueTimeout - utime.ticks_diff(utime.ticks_ms(), t0)
+                if wait <= 0:
+                    return False
+                try:
+                    await uasyncio.wait_for_ms(self.slotFree.wait(), wait)
+                except uasyncio.TimeoutError:
+                    return False
+            return True
+        finally:
+            self.waiting -= 1
+
+
+    async def handle_request(self, reader, writer):
+        if not await self.admit():
+            self.rejected += 1
+            try:
+                await writer.awrite(REPLY_503)
+            except OSError:
+                pass
+            await self.close(writer)
+            return
+
+        self.active += 1
+        self.accepted += 1
+        try:
+            await self.serve(reader, writer)
+        finally:
+            self.active -= 1
+            self.lastActivity = utime.ticks_ms()
+            gcManager.activity()
+            self.slotFree.set()
+            self.slotFree.clear()
+
+
+    # receive request (with timeout and size limits), dispatch it and send the response
+    async def serve(self, reader, writer):
+        req = None
+        try:
+            req = await uasyncio.wait_for_ms(Request.create(self, HeaderLimitReader(reader, self.maxHeaderSize), writer,
+                                                            writer.get_extra_info('peername')), self.requestTimeout)
+        except uasyncio.TimeoutError:
+            self.timeouts += 1
+            await self.close(writer)
+            return
+        except Exception as exc:
+            # invalid or too large request, answered with 400
+            log.warning("Invalid request: %s", exc)
+
+        res = await self.dispatch_request(req)
+        if res != Response.already_handled:
+            await res.write(writer)
+        await self.close(writer)
+        if req and (log.level <= LOG_DEBUG):
+            log.debug("%s %s %d", (req.method, req.path, res.status_code))
+
+
+    # close connection
+    async def close(self, writer):
+        try:
+            await writer.aclose()
+        except OSError as exc:
+            if exc.errno not in MUTED_SOCKET_ERRORS:
+                raise
+
+
+    # connection counters in Prometheus text format
+    def metrics(self):
+        yield "# TYPE alpaca_connections_active gauge\n"
+        yield "alpaca_connections_active " + str(self.active) + "\n"
+        yield "# TYPE alpaca_connections_waiting gauge\n"
+        yield "alpaca_connections_waiting " + str(self.waiting) + "\n"
+        yield "# TYPE alpaca_connections_total counter\n"
+        yield "alpaca_connections_total{result=\"accepted\"} " + str(self.accepted) + "\n"
+        yield "alpaca_connections_total{result=\"rejected\"} " + str(self.rejected) + "\n"
+        yield "alpaca_connections_total{result=\"timeout\"} " + str(self.timeouts) + "\n"
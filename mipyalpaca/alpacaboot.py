@@ -0,0 +1,36 @@
+import utime
+
+
+# Boot profile of the Alpaca server
+# records the time of the boot phases in ms since reset (utime.ticks_ms() starts at 0 on reset)
+# up to the first answered discovery packet
+class BootProfile:
+
+    def __init__(self):
+        self.phases = []   # (phase name, ticks_ms)
+        self.mark("start")
+
+    # record phase
+    def mark(self, phase):
+        self.phases.append((phase, utime.ticks_ms()))
+
+    # record phase, if not yet recorded
+    def first(self, phase):
+        for name, t in self.phases:
+            if name == phase:
+                return False
+        self.mark(phase)
+        return True
+
+    # boot phases with time since reset and duration since the previous phase in ms
+    def report(self):
+        r = []
+        last = None
+        for name, t in self.phases:
+            r.append({"Phase": name, "Time": t, "Delta": 0 if last is None else utime.ticks_diff(t, last)})
+            last = t
+        return r
+
+
+# boot profile of the Alpaca server
+boot = BootProfile()
@@ -0,0 +1,91 @@
+import uasyncio
+import utime
+from array import array
+from mipyalpaca.alpacaserver import isAwaitable
+
+
+# Read cache of switch values with time to live per switch
+# a value read by the getter is reused until its TTL has expired; while an async read
+# is in flight, further reads of the same switch wait for its result instead of
+# starting another one; writing a switch invalidates its entry
+class ReadCache:
+
+    def __init__(self, ttls):
+        n = len(ttls)
+        self.ttl = array("L", ttls)            # time to live per switch in ms (0: not cached)
+        self.stamp = array("L", [0] * n)       # time of the cached read
+        self.valid = bytearray(n)              # 1 if the cached value is valid
+        self.gen = array("H", bytes(2 * n))    # generation, incremented on invalidation
+        self.value = [0] * n                   # cached values
+        self.inflight = [None] * n             # Event of the running async read
+        self.hits = 0                          # reads served from the cache
+        self.misses = 0                        # reads passed to the getter
+
+
+    # True if the cached value of switch id is valid and not expired
+    def fresh(self, id):
+        return self.valid[id] and (utime.ticks_diff(utime.ticks_ms(), self.stamp[id]) < self.ttl[id])
+
+
+    # return cached value of switch id or None
+    def peek(self, id):
+        if self.ttl[id] and self.fresh(id):
+            return self.value[id]
+        return None
+
+
+    # read value of switch id, fct(id) is called on a cache miss
+    # returns the value or an awaitable if an async read is running
+    def get(self, id, fct):
+        if self.ttl[id] == 0:
+            return fct(id)
+        if self.fresh(id):
+            self.hits += 1
+            return self.value[id]
+        if self.inflight[id] is not None:
+            self.hits += 1
+            return self.wait(id, fct)
+        self.misses += 1
+        res = fct(id)
+        if isAwaitable(res):
+            self.inflight[id] = uasyncio.Event()
+            return self.fill(id, res, self.gen[id])
+        self.put(id, res, self.gen[id])
+        return res
+
+
+    # store value read in generation gen (dropped if the switch has been written meanwhile)
+    def put(self, id, value, gen):
+        if gen == self.gen[id]:
+            self.value[id] = value
+            self.stamp[id] = utime.ticks_ms()
+            self.valid[id] = 1
+
+
+    # await async read and store its value
+    async def fill(self, id, aw, gen):
+        try:
+            v = await aw
+            self.put(id, v, gen)
+            return v
+        finally:
+            ev = self.inflight[id]
+            self.inflight[id] = None
+            ev.set()
+
+
+    # wait for the running read of switch id (read again if it failed or has been invalidated)
+    async def wait(self, id, fct):
+        await self.inflight[id].wait()
+        if self.fresh(id):
+            return self.value[id]
+        res = fct(id)
+        if isAwaitable(res):
+            res = await res
+        return res
+
+
+    # invalidate cached value of switch id
+    def invalidate(self, id):
+        self.valid[id] = 0
+        self.gen[id] = (self.gen[id] + 1) & 0xFFFF
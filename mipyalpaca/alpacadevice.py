@@ -12,11 +12,50 @@ class AlpacaDevice:
         self.connectedState = False          # connection status
         self.uniqueid = uniqueid             # uid
         self.server = None                   # attached Alpaca Server  
+        self.actions = {}                    # supported actions: lower case name -> (name, function)
+        self.metaCache = None                # JSON encoded static metadata (None: to be built)
+        self.callTimeout = None              # timeout of async calls in ms (None: server default)
+    
+    # called after the device has been installed on the Alpaca server
+    def installed(self):
+        pass
     
     # compose reply
     def reply(self, request, value=None, err_nr=0, err_msg=""):
         return AlpacaServer.reply(request, value, err_nr, err_msg)
     
+    # compose reply after value of async hook is available
+    async def replyAsync(self, request, aw):
+        return self.reply(request, await aw)
+    
+    # compose reply from cached metadata value (key, optional switch/item id)
+    def replyMeta(self, request, key, id=None):
+        if self.metaCache is None:
+            self.metaCache = self.buildMetaCache()
+        value = self.metaCache[key]
+        if id is not None:
+            value = value[id]
+        return AlpacaServer.reply(request, value, encoded=True)
+
+    # encode static metadata values for the metadata cache
+    def buildMetaCache(self):
+        enc = AlpacaServer.replyWriter.encode
+        return {"name": enc(self.name), "description": enc(self.description), "driverinfo": enc(self.driverinfo),
+                "driverversion": enc(self.driverVersion), "interfaceversion": enc(self.interfaceVersion)}
+
+    # invalidate metadata cache and setup pages (call after changing name, description etc.)
+    def invalidateMetaCache(self):
+        self.metaCache = None
+        invalidatePages()
+    
+    # current values for new change stream subscribers: (device type, device number, id, value) tuples
+    def snapshot(self):
+        return ()
+
+    # publish values changed without a client request to the change stream (called by the stream watcher)
+    def pollChanges(self):
+        pass
+    
     # set connection status
     def PUT_connected(self, request):
         val = request.form.get('Connected')
@@ -31,27 +70,45 @@ class AlpacaDevice:
 
     # return device name
     def GET_name(self, request):
-        return self.reply(request, self.name)
+        return self.replyMeta(request, "name")
     
     # return device description
     def GET_description(self, request):
-        return self.reply(request, self.description)
+        return self.replyMeta(request, "description")
 
     # return device driver info
     def GET_driverinfo(self, request):
-        return self.reply(request, self.driverinfo)
+        return self.replyMeta(request, "driverinfo")
 
     #return device driver version
     def GET_driverversion(self, request):
-        return self.reply(request, self.driverVersion)
+        return self.replyMeta(request, "driverversion")
     
     #return device interface version
     def GET_interfaceversion(self, request):
-        return self.reply(request, self.interfaceVersion)
+        return self.replyMeta(request, "interfaceversion")
+
+    # add supported action, fct(parameters) returns the action result string
+    # fct may be an async def function
+    def addAction(self, name, fct):
+        self.actions[name.lower()] = (name, fct)
 
     #return supported (additional) device actions
     def GET_supportedactions(self, request):
-        return self.reply(request, [])
+        return self.reply(request, [a[0] for a in self.actions.values()])
+
+    # invoke device action
+    def PUT_action(self, request):
+        name = request.form.get('Action')
+        if name is None:
+            raise CallArgError("Invalid or missing action name")
+        action = self.actions.get(name.lower())
+        if action is None:
+            raise ActionNotImplementedError("Action " + name + " is not implemented")
+        res = action[1](request.form.get('Parameters'))
+        if isAwaitable(res):
+            return self.replyAsync(request, res)
+        return self.reply(request, res)
 
     # return setup page
     def setupRequest(self, request):
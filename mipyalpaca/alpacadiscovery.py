@@ -0,0 +1,149 @@
+import uasyncio
+import socket
+import struct
+import utime
+from uasyncio import core
+from mipyalpaca.alpacalog import log
+from mipyalpaca.alpacaboot import boot
+
+
+# Alpaca discovery message and IPv6 multicast group (ff12::a1:9aca)
+DISCOVERY_MSG = b"alpacadiscovery1"
+DISCOVERY_V6_GROUP = b"\xff\x12" + bytes(10) + b"\x00\xa1\x9a\xca"
+
+
+# Awaitable that suspends the current task until a socket is readable.
+# The task is parked on the asyncio poll queue, so nothing runs while idle.
+class SocketReadable:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __iter__(self):
+        yield core._io_queue.queue_read(self.sock)
+
+    __await__ = __iter__
+
+
+# Alpaca discovery responder
+class AlpacaDiscovery:
+
+    def __init__(self, server):
+        self.server = server
+        self.sockets = []        # open discovery sockets
+        self.tasks = []          # responder tasks (one per socket)
+        self.payloadPort = None  # server port the cached payload was built for
+        self.payload = b""       # cached discovery reply
+        self.maxRate = 10        # max. replies per second (0: unlimited)
+        self.tokens = 0          # available replies of rate limiter
+        self.tokenTime = 0       # last refill of rate limiter
+        self.received = 0        # received discovery packets
+        self.replied = 0         # sent discovery replies
+        self.dropped = 0         # packets dropped by rate limiter or invalid
+
+
+    # return reply payload, rebuilt only if the server port has changed
+    def getPayload(self):
+        port = self.server.config["serverPort"]
+        if port != self.payloadPort:
+            self.payload = ("{\"AlpacaPort\":" + str(int(port)) + "}").encode()
+            self.payloadPort = port
+        return self.payload
+
+
+    # token bucket rate limiter, returns True if a reply may be sent
+    def allowReply(self):
+        if self.maxRate <= 0:
+            return True
+        now = utime.ticks_ms()
+        refill = utime.ticks_diff(now, self.tokenTime) * self.maxRate // 1000
+        if refill > 0:
+            self.tokens = min(self.maxRate, self.tokens + refill)
+            self.tokenTime = now
+        if self.tokens <= 0:
+            return False
+        self.tokens -= 1
+        return True
+
+
+    # open IPv4 discovery socket
+    def openV4(self, port):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("", port))
+        return s
+
+
+    # open IPv6 discovery socket and join the Alpaca multicast group
+    # returns None if the port does not support IPv6 multicast
+    def openV6(self, port):
+        join = getattr(socket, "IPV6_JOIN_GROUP", None)
+        if not hasattr(socket, "AF_INET6") or join is None:
+            log.info("IPv6 discovery not supported")
+            return None
+        try:
+            s = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("::", port))
+            s.setsockopt(socket.IPPROTO_IPV6, join, DISCOVERY_V6_GROUP + struct.pack("I", 0))
+        except OSError as e:
+            log.warning("IPv6 discovery not available: %s", e)
+            return None
+        return s
+
+
+    # open discovery sockets and start one responder task per socket
+    def start(self):
+        cfg = self.server.config
+        port = int(cfg["discoveryPort"])
+        self.maxRate = int(cfg.get("discoveryMaxRate", self.maxRate))
+        self.tokens = self.maxRate
+        self.tokenTime = utime.ticks_ms()
+
+        self.sockets.append(self.openV4(port))
+        if str(cfg.get("discoveryIPv6", False)).lower() in ("1", "true"):
+            s6 = self.openV6(port)
+            if s6 is not None:
+                self.sockets.append(s6)
+
+        for s in self.sockets:
+            s.setblocking(False)
+            self.tasks.append(uasyncio.create_task(self.respond(s)))
+        log.info("Start Discovery")
+
+
+    # cancel responder tasks and close discovery sockets
+    def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        for s in self.sockets:
+            s.close()
+        self.tasks = []
+        self.sockets = []
+
+
+    # reopen discovery sockets (e.g. after network reconnect or port change)
+    def rearm(self):
+        self.stop()
+        self.start()
+
+
+    # responder loop, sleeps until a discovery packet arrives
+    async def respond(self, s):
+        readable = SocketReadable(s)
+        while True:
+            await readable
+            try:
+                data, address = s.recvfrom(64)
+            except OSError:
+                continue
+            self.received += 1
+            if not data.startswith(DISCOVERY_MSG) or not self.allowReply():
+                self.dropped += 1
+                continue
+            try:
+                s.sendto(self.getPayload(), address)
+                self.replied += 1
+                if self.replied == 1 and boot.first("discovery"):
+                    log.info("First discovery reply %d ms after reset", boot.phases[-1][1])
+            except OSError:
+                self.dropped += 1
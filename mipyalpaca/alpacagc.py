@@ -0,0 +1,124 @@
+import gc
+import uasyncio
+import utime
+
+
+# heap functions (MicroPython only)
+_mem_free = getattr(gc, "mem_free", None)
+_mem_alloc = getattr(gc, "mem_alloc", None)
+_threshold = getattr(gc, "threshold", None)
+
+
+# Garbage collection manager
+# collects in idle windows between requests (and after heavy operations like config writes
+# and page renders), so that automatic collections rarely hit the request path;
+# the automatic GC threshold is tuned from the free heap after each collection;
+# the manager task only wakes up after finished connections and requested collections
+class GcManager:
+
+    def __init__(self):
+        self.enabled = True
+        self.idleDelay = 20          # time without requests before an idle collection in ms
+        self.maxInterval = 10000     # idle collection at least every maxInterval ms (ports without heap info)
+        self.idleFraction = 0.25     # idle collection after allocating this fraction of the free heap
+        self.autoFraction = 0.75     # automatic collection after allocating this fraction of the free heap
+        self.busy = None             # function returning (active connections, time of last activity)
+        self.pending = False         # collection requested after heavy operation
+        self.wake = uasyncio.Event() # set after a finished connection or a requested collection
+        self.lastCollect = utime.ticks_ms()
+        self.allocAfter = 0          # allocated heap after last collection
+        self.freeAfter = 0           # free heap after last collection
+        self.collections = 0         # collections of the manager
+        self.requested = 0           # collections after heavy operations
+        self.pauseSum = 0            # sum of collection pauses in us
+        self.pauseMax = 0            # longest collection pause in us
+        self.pauseLast = 0           # last collection pause in us
+        self.threshold = -1          # automatic GC threshold in bytes (-1: not set)
+        self.task = None
+
+
+    # apply server configuration and start manager task
+    # busy() returns the number of active connections and the time of the last activity
+    def start(self, config, busy):
+        self.enabled = config.get("gcManager", True)
+        self.idleDelay = int(config.get("gcIdleDelay", self.idleDelay))
+        self.idleFraction = float(config.get("gcIdleFraction", self.idleFraction))
+        self.autoFraction = float(config.get("gcAutoFraction", self.autoFraction))
+        self.busy = busy
+        if self.enabled and self.task is None:
+            self.collect()
+            self.task = uasyncio.create_task(self.run())
+
+
+    # request collection in the next idle window (call after heavy operations)
+    def collectSoon(self):
+        self.pending = True
+        self.wake.set()
+
+
+    # connection finished: check for a collection in the following idle window
+    def activity(self):
+        self.wake.set()
+
+
+    # collect now, measure pause and tune the automatic threshold
+    def collect(self):
+        t0 = utime.ticks_us()
+        gc.collect()
+        pause = utime.ticks_diff(utime.ticks_us(), t0)
+        self.lastCollect = utime.ticks_ms()
+        self.collections += 1
+        self.pauseLast = pause
+        self.pauseSum += pause
+        if pause > self.pauseMax:
+            self.pauseMax = pause
+        if _mem_free is not None:
+            self.freeAfter = _mem_free()
+            self.allocAfter = _mem_alloc()
+            if _threshold is not None:
+                self.threshold = int(self.freeAfter * self.autoFraction)
+                _threshold(self.threshold)
+
+
+    # True if a collection is due
+    def due(self):
+        if self.pending:
+            return True
+        if _mem_alloc is None:
+            return utime.ticks_diff(utime.ticks_ms(), self.lastCollect) >= self.maxInterval
+        return (_mem_alloc() - self.allocAfter) > self.freeAfter * self.idleFraction
+
+
+    # manager task, collects when no request is active for idleDelay ms
+    # (sleeps until woken up, a connection finished later wakes it up again)
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            await uasyncio.sleep_ms(self.idleDelay)
+            active, last = self.busy()
+            if (active == 0) and (utime.ticks_diff(utime.ticks_ms(), last) >= self.idleDelay) and self.due():
+                if self.pending:
+                    self.requested += 1
+                    self.pending = False
+                self.collect()
+
+
+    # collection statistics in Prometheus text format
+    def metrics(self):
+        yield "# TYPE alpaca_gc_collections_total counter\n"
+        yield "alpaca_gc_collections_total " + str(self.collections) + "\n"
+        yield "# TYPE alpaca_gc_requested_total counter\n"
+        yield "alpaca_gc_requested_total " + str(self.requested) + "\n"
+        yield "# TYPE alpaca_gc_pause_us_sum counter\n"
+        yield "alpaca_gc_pause_us_sum " + str(self.pauseSum) + "\n"
+        yield "# TYPE alpaca_gc_pause_us_max gauge\n"
+        yield "alpaca_gc_pause_us_max " + str(self.pauseMax) + "\n"
+        yield "# TYPE alpaca_gc_pause_us_last gauge\n"
+        yield "alpaca_gc_pause_us_last " + str(self.pauseLast) + "\n"
+        yield "# TYPE alpaca_gc_threshold_bytes gauge\n"
+        yield "alpaca_gc_threshold_bytes " + str(self.threshold) + "\n"
+
+
+# garbage collection manager of the Alpaca server
+gcManager = GcManager()
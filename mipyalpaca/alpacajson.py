@@ -0,0 +1,162 @@
+import ujson
+
+
+# precompiled byte templates of the Alpaca reply envelope
+_SRV_TID = b'{"ServerTransactionID":'
+_CLT_TID = b',"ClientTransactionID":'
+_ERR_NR = b',"ErrorNumber":'
+_ERR_MSG = b',"ErrorMessage":'
+_VALUE = b',"Value":'
+_END = b'}'
+_TRUE = b'true'
+_FALSE = b'false'
+_NULL = b'null'
+_EMPTY_STR = b'""'
+_HEX = b'0123456789abcdef'
+
+# short JSON escapes of special characters (other control characters are written as \u00XX)
+_ESCAPES = {0x22: b'\\"', 0x5C: b'\\\\', 0x0A: b'\\n', 0x0D: b'\\r', 0x09: b'\\t', 0x08: b'\\b', 0x0C: b'\\f'}
+
+
+# JSON writer for Alpaca replies
+# writes the reply envelope directly into a reusable buffer, so only the final
+# bytes object of the reply body is allocated for scalar, string and list values
+class ReplyWriter:
+
+    def __init__(self, size=256):
+        self.buf = bytearray(size)        # reusable output buffer
+        self.mv = memoryview(self.buf)    # view on output buffer
+        self.pos = 0                      # current write position
+
+
+    # make sure that n more bytes fit into the buffer (buffer size is doubled if required)
+    def reserve(self, n):
+        end = self.pos + n
+        if end > len(self.buf):
+            newbuf = bytearray(max(end, 2 * len(self.buf)))
+            newbuf[:self.pos] = self.mv[:self.pos]
+            self.buf = newbuf
+            self.mv = memoryview(newbuf)
+        return end
+
+
+    # write bytes
+    def put(self, data):
+        end = self.reserve(len(data))
+        self.mv[self.pos:end] = data
+        self.pos = end
+
+
+    # write integer value (digit by digit, no string conversion)
+    def putInt(self, v):
+        if v < 0:
+            self.put(b'-')
+            v = -v
+        n = 1
+        t = v // 10
+        while t:
+            t //= 10
+            n += 1
+        end = self.reserve(n)
+        i = end
+        while i > self.pos:
+            i -= 1
+            self.buf[i] = 48 + v % 10
+            v //= 10
+        self.pos = end
+
+
+    # write string value
+    def putStr(self, s):
+        if not s:
+            self.put(_EMPTY_STR)
+            return
+        data = s.encode()
+        self.put(b'"')
+        for c in data:
+            if (c < 0x20) or (c == 0x22) or (c == 0x5C):
+                self.putEscaped(data)
+                break
+        else:
+            self.put(data)
+        self.put(b'"')
+
+
+    # write UTF-8 encoded string data with JSON escapes (without quotes)
+    def putEscaped(self, data):
+        for c in data:
+            if (c >= 0x20) and (c != 0x22) and (c != 0x5C):
+                end = self.reserve(1)
+                self.buf[self.pos] = c
+                self.pos = end
+            elif c in _ESCAPES:
+                self.put(_ESCAPES[c])
+            else:
+                self.put(b'\\u00')
+                end = self.reserve(2)
+                self.buf[self.pos] = _HEX[c >> 4]
+                self.buf[self.pos + 1] = _HEX[c & 15]
+                self.pos = end
+
+
+    # write any JSON value
+    def putValue(self, v):
+        if v is None:
+            self.put(_NULL)
+        elif v is True:
+            self.put(_TRUE)
+        elif v is False:
+            self.put(_FALSE)
+        elif type(v) is int:
+            self.putInt(v)
+        elif type(v) is float:
+            if v - v == 0.0:
+                self.put(str(v).encode())
+            else:
+                # nan and inf have no JSON representation
+                self.put(_NULL)
+        elif type(v) is str:
+            self.putStr(v)
+        elif type(v) is list or type(v) is tuple:
+            self.put(b'[')
+            first = True
+            for item in v:
+                if not first:
+                    self.put(b',')
+                first = False
+                self.putValue(item)
+            self.put(b']')
+        else:
+            # fallback for all other types (e.g. dicts)
+            self.put(ujson.dumps(v).encode())
+
+
+    # return JSON encoding of value as bytes (for pre-encoded reply values)
+    def encode(self, value):
+        self.pos = 0
+        self.putValue(value)
+        return bytes(self.mv[:self.pos])
+
+
+    # write Alpaca reply and return it as bytes
+    # client_tid None omits ClientTransactionID, has_value False omits Value
+    # encoded True: value is already JSON encoded (bytes)
+    def reply(self, server_tid, client_tid, err_nr, err_msg, value, has_value=True, encoded=False):
+        self.pos = 0
+        self.put(_SRV_TID)
+        self.putInt(server_tid)
+        if client_tid is not None:
+            self.put(_CLT_TID)
+            self.putInt(client_tid)
+        self.put(_ERR_NR)
+        self.putInt(err_nr)
+        self.put(_ERR_MSG)
+        self.putStr(err_msg)
+        if has_value:
+            self.put(_VALUE)
+            if encoded:
+                self.put(value)
+            else:
+                self.putValue(value)
+        self.put(_END)
+        return bytes(self.mv[:self.pos])
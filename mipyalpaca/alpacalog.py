@@ -0,0 +1,108 @@
+import utime
+from array import array
+
+
+# log levels
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+
+LogLevels = {"DEBUG": LOG_DEBUG, "INFO": LOG_INFO, "WARNING": LOG_WARNING, "ERROR": LOG_ERROR}
+LogLevelNames = {LOG_DEBUG: "DEBUG", LOG_INFO: "INFO", LOG_WARNING: "WARNING", LOG_ERROR: "ERROR"}
+
+
+# format message msg with argument arg
+def formatMsg(msg, arg):
+    if arg is not None:
+        try:
+            msg = msg % arg
+        except (TypeError, ValueError):
+            msg = msg + " " + str(arg)
+    return msg
+
+
+# Logger of the Alpaca server
+# records (time, level, message, argument) are kept in a preallocated ring buffer,
+# the message is only formatted (message % argument) when the log is read;
+# records below the log level are dropped before anything is stored
+class RingLog:
+
+    def __init__(self, size=64):
+        self.level = LOG_INFO   # minimum level of stored records
+        self.console = False    # print records on the console as well
+        self.alloc(size)
+
+
+    # allocate ring buffer (existing records are dropped)
+    def alloc(self, size):
+        self.size = max(1, size)
+        self.times = array("L", [0] * self.size)        # ticks_ms of records
+        self.levels = bytearray(self.size)              # levels of records
+        self.msgs = [None] * self.size                  # message (format string) of records
+        self.args = [None] * self.size                  # argument of records
+        self.seq = 0                                    # number of records logged
+
+
+    # apply server configuration
+    def configure(self, config):
+        self.level = LogLevels.get(str(config.get("logLevel", "INFO")).upper(), LOG_INFO)
+        self.console = config.get("logConsole", False)
+        size = int(config.get("logSize", self.size))
+        if size != self.size:
+            self.alloc(size)
+
+
+    # store record, arg is a single value or a tuple of values for the format string msg
+    # show True prints the record on the console regardless of level and logConsole
+    def log(self, level, msg, arg=None, show=False):
+        if level < self.level:
+            if show:
+                print(formatMsg(msg, arg))
+            return
+        i = self.seq % self.size
+        self.times[i] = utime.ticks_ms() & 0x3FFFFFFF
+        self.levels[i] = level
+        self.msgs[i] = msg
+        self.args[i] = arg
+        self.seq += 1
+        if self.console or show:
+            print(self.format(i))
+
+    def debug(self, msg, arg=None):
+        if self.level <= LOG_DEBUG:
+            self.log(LOG_DEBUG, msg, arg)
+
+    def info(self, msg, arg=None):
+        if self.level <= LOG_INFO:
+            self.log(LOG_INFO, msg, arg)
+
+    def warning(self, msg, arg=None):
+        if self.level <= LOG_WARNING:
+            self.log(LOG_WARNING, msg, arg)
+
+    def error(self, msg, arg=None):
+        self.log(LOG_ERROR, msg, arg)
+
+    # INFO record that is always printed on the console (e.g. the IP address of the server)
+    def notice(self, msg, arg=None):
+        self.log(LOG_INFO, msg, arg, True)
+
+
+    # format record at buffer index i
+    def format(self, i):
+        return (str(self.times[i]) + " " + LogLevelNames.get(self.levels[i], "?") + " " +
+                formatMsg(self.msgs[i], self.args[i]))
+
+
+    # formatted records with sequence number >= since and level >= level, oldest first
+    def render(self, since=0, level=0):
+        first = max(since, self.seq - self.size, 0)
+        for n in range(first, self.seq):
+            i = n % self.size
+            if self.levels[i] >= level:
+                yield str(n) + " " + self.format(i) + "\n"
+
+
+# logger of the Alpaca server
+log = RingLog()
@@ -0,0 +1,145 @@
+import gc
+import utime
+from array import array
+
+
+# upper bounds of latency histogram buckets in us (last bucket: +Inf)
+LATENCY_BUCKETS_US = (1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000, 1000000)
+LATENCY_BUCKET_LABELS = ("1", "2", "5", "10", "20", "50", "100", "200", "500", "1000", "+Inf")
+NBUCKETS = len(LATENCY_BUCKET_LABELS)
+
+# heap usage is sampled every HEAP_SAMPLE_INTERVAL requests (gc.mem_free() scans the heap)
+HEAP_SAMPLE_INTERVAL = 16
+
+# heap functions (MicroPython only)
+_mem_free = getattr(gc, "mem_free", None)
+_mem_alloc = getattr(gc, "mem_alloc", None)
+
+
+# Request metrics of the Alpaca server
+# each route (API method of a device or management route) has a slot in the
+# preallocated counter arrays, slots are registered at install time
+class Metrics:
+
+    def __init__(self):
+        self.enabled = True
+        self.labels = []             # Prometheus labels per slot
+        self.slots = {}              # Prometheus labels -> slot
+        self.count = array("L")      # requests per slot
+        self.http400 = array("L")    # HTTP 400 replies per slot
+        self.latSum = []             # sum of latencies per slot in us (list: exceeds 32 bit)
+        self.hist = array("L")       # latency histogram, slot * NBUCKETS + bucket
+        self.errors = {}             # (slot, Alpaca error number) -> count
+        self.samples = 0             # requests since last heap sample
+        self.memFreeMin = -1         # lowest free heap seen
+        self.memAllocMax = 0         # highest allocated heap seen
+        self.sources = []            # (name, function) returning additional metric lines
+        self.unknownSlot = self.register('route="unknown"')
+
+
+    # register route with Prometheus labels, returns slot number
+    # (a route registered again, e.g. after a re-initialisation of the server, keeps its slot)
+    def register(self, labels):
+        slot = self.slots.get(labels)
+        if slot is not None:
+            return slot
+        self.slots[labels] = len(self.labels)
+        self.labels.append(labels)
+        self.count.append(0)
+        self.http400.append(0)
+        self.latSum.append(0)
+        for _ in range(NBUCKETS):
+            self.hist.append(0)
+        return len(self.labels) - 1
+
+
+    # register function fct() returning an iterable of additional metric lines
+    # a source registered again under the same name replaces the previous one
+    def addSource(self, name, fct):
+        for i in range(len(self.sources)):
+            if self.sources[i][0] == name:
+                self.sources[i] = (name, fct)
+                return
+        self.sources.append((name, fct))
+
+
+    # record finished request of slot, started at t0 (utime.ticks_us)
+    # result is the handler return value, err_nr the Alpaca error number of the reply
+    def observe(self, slot, t0, result, err_nr=0):
+        if not self.enabled:
+            return
+        dt = utime.ticks_diff(utime.ticks_us(), t0)
+        self.count[slot] += 1
+        self.latSum[slot] += dt
+        b = 0
+        for bound in LATENCY_BUCKETS_US:
+            if dt <= bound:
+                break
+            b += 1
+        self.hist[slot * NBUCKETS + b] += 1
+
+        if type(result) is tuple and result[1] == 400:
+            self.http400[slot] += 1
+        elif err_nr:
+            key = (slot, err_nr)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+        self.samples += 1
+        if self.samples >= HEAP_SAMPLE_INTERVAL:
+            self.samples = 0
+            self.sampleHeap()
+
+
+    # update heap watermarks
+    def sampleHeap(self):
+        if _mem_free is None:
+            return
+        free = _mem_free()
+        alloc = _mem_alloc()
+        if (self.memFreeMin < 0) or (free < self.memFreeMin):
+            self.memFreeMin = free
+        if alloc > self.memAllocMax:
+            self.memAllocMax = alloc
+
+
+    # generate metrics in Prometheus text format (line by line)
+    def render(self):
+        yield "# TYPE alpaca_requests_total counter\n"
+        for slot in range(len(self.labels)):
+            if self.count[slot]:
+                yield "alpaca_requests_total{" + self.labels[slot] + "} " + str(self.count[slot]) + "\n"
+        yield "# TYPE alpaca_http400_total counter\n"
+        for slot in range(len(self.labels)):
+            if self.http400[slot]:
+                yield "alpaca_http400_total{" + self.labels[slot] + "} " + str(self.http400[slot]) + "\n"
+        yield "# TYPE alpaca_errors_total counter\n"
+        for (slot, err_nr), n in self.errors.items():
+            yield "alpaca_errors_total{" + self.labels[slot] + ",error_number=\"" + str(err_nr) + "\"} " + str(n) + "\n"
+        yield "# TYPE alpaca_request_duration_ms histogram\n"
+        for slot in range(len(self.labels)):
+            if not self.count[slot]:
+                continue
+            lbl = self.labels[slot]
+            cum = 0
+            for b in range(NBUCKETS):
+                cum += self.hist[slot * NBUCKETS + b]
+                yield "alpaca_request_duration_ms_bucket{" + lbl + ",le=\"" + LATENCY_BUCKET_LABELS[b] + "\"} " + str(cum) + "\n"
+            yield "alpaca_request_duration_ms_sum{" + lbl + "} " + str(self.latSum[slot] / 1000) + "\n"
+            yield "alpaca_request_duration_ms_count{" + lbl + "} " + str(self.count[slot]) + "\n"
+        for name, fct in self.sources:
+            for line in fct():
+                yield line
+        if _mem_free is not None:
+            self.sampleHeap()
+            yield "# TYPE alpaca_heap_free_bytes gauge\n"
+            yield "alpaca_heap_free_bytes " + str(_mem_free()) + "\n"
+            yield "# TYPE alpaca_heap_free_min_bytes gauge\n"
+            yield "alpaca_heap_free_min_bytes " + str(self.memFreeMin) + "\n"
+            yield "# TYPE alpaca_heap_alloc_bytes gauge\n"
+            yield "alpaca_heap_alloc_bytes " + str(_mem_alloc()) + "\n"
+            yield "# TYPE alpaca_heap_alloc_max_bytes gauge\n"
+            yield "alpaca_heap_alloc_max_bytes " + str(self.memAllocMax) + "\n"
+
+
+# metrics of the Alpaca server
+metrics = Metrics()
@@ -0,0 +1,106 @@
+import io
+import hashlib
+import binascii
+from microdot_asyncio import Response
+from mipyalpaca.alpacagc import gcManager
+
+try:
+    import deflate    # MicroPython >= 1.21 (compression has to be enabled in the port)
+except ImportError:
+    deflate = None
+
+# window size of gzip compression (2^10 bytes, keeps the compressor small)
+GZIP_WBITS = 10
+
+
+# gzip compress data, returns None if compression is not available
+def gzipData(data):
+    if deflate is None:
+        return None
+    buf = io.BytesIO()
+    try:
+        with deflate.DeflateIO(buf, deflate.GZIP, GZIP_WBITS) as d:
+            d.write(data)
+    except (AttributeError, OSError, ValueError):
+        # port without compression support
+        return None
+    return buf.getvalue()
+
+
+# Rendered page of the page cache
+# the gzipped and the uncompressed variant have different ETags (a cache must not mix them up)
+class CachedPage:
+    __slots__ = ("etag", "etagGz", "body", "gzipped")
+
+    def __init__(self, body):
+        h = binascii.hexlify(hashlib.sha256(body).digest()[:8]).decode()
+        self.etag = '"' + h + '"'          # ETag of the uncompressed page
+        self.etagGz = '"' + h + '-gz"'     # ETag of the gzipped page
+        self.gzipped = gzipData(body)
+        # uncompressed page is only kept if it cannot be sent compressed
+        self.body = body if self.gzipped is None else None
+
+
+# Cache of rendered setup pages
+# pages are rendered once, kept gzipped and served with ETag (304 on conditional GET),
+# the cache is invalidated when the server configuration or the devices change
+class PageCache:
+
+    def __init__(self):
+        self.pages = {}   # page key -> CachedPage
+
+
+    # invalidate cached page (all pages if key is None)
+    def invalidate(self, key=None):
+        if key is None:
+            self.pages = {}
+        elif key in self.pages:
+            del self.pages[key]
+
+
+    # return response for page key, render() returns the rendered page (str or iterator of str)
+    def respond(self, request, key, render):
+        page = self.pages.get(key)
+        if page is None:
+            page = self.pages[key] = CachedPage(renderPage(render))
+
+        gz = (page.gzipped is not None) and ("gzip" in request.headers.get("Accept-Encoding", ""))
+        etag = page.etagGz if gz else page.etag
+        headers = {"Content-Type": "text/html; charset=UTF-8", "ETag": etag,
+                   "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etagMatch(request.headers.get("If-None-Match"), etag):
+            return Response(b"", 304, headers)
+
+        if gz:
+            headers["Content-Encoding"] = "gzip"
+            return Response(page.gzipped, 200, headers)
+        if page.body is None:
+            # rare client without gzip support: render again
+            return Response(renderPage(render), 200, headers)
+        return Response(page.body, 200, headers)
+
+
+# True if the If-None-Match header (single ETag, list of ETags or "*") contains etag
+def etagMatch(header, etag):
+    if header is None:
+        return False
+    if header == etag:
+        return True
+    for t in header.split(","):
+        t = t.strip()
+        if (t == etag) or (t == "*") or (t == "W/" + etag):
+            return True
+    return False
+
+
+# render page to bytes (rendering leaves garbage, collected in the next idle window)
+def renderPage(render):
+    html = render()
+    if not isinstance(html, str):
+        html = "".join(html)
+    gcManager.collectSoon()
+    return html.encode()
+
+
+# setup pages of the Alpaca server
+pages = PageCache()
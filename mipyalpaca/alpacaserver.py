@@ -1,28 +1,51 @@
+from mipyalpaca.alpacaboot import boot    # first import: boot profile starts here
+import sys
 import ujson
 import uasyncio
-import uselect
-import socket
-from microdot_asyncio import Microdot
-from microdot_utemplate import render_template
+import utime
 from microdot_asyncio import Response
-import network
+from mipyalpaca.alpacadiscovery import AlpacaDiscovery
+from mipyalpaca.alpacajson import ReplyWriter
+from mipyalpaca.alpacastore import persister, writeFileAtomic, recoverFile
+from mipyalpaca.alpacametrics import metrics
+from mipyalpaca.alpacawlan import WlanSupervisor
+from mipyalpaca.alpacastream import stream, StreamResponse
+from mipyalpaca.alpacaapp import AlpacaApp
+from mipyalpaca.alpacagc import gcManager
+from mipyalpaca.alpacalog import log, LogLevels
 
 
-alpaca_app = Microdot()
+alpaca_app = AlpacaApp()
 
 # Read JSON file from filename
 def readJson(filename):
+    recoverFile(filename)
     with open(filename) as fp:
         jdata = ujson.load(fp)    
     fp.close()
     return jdata
 
 
-# Write JSON to file filename
+# Write JSON to file filename (atomic)
 def writeJson(filename, jdata):
-    with open(filename, "w") as fp:
-        fp.write(ujson.dumps(jdata))
-    fp.close()
+    writeFileAtomic(filename, ujson.dumps(jdata))
+
+
+# lower case variants of argument names (avoids repeated key.lower() allocations)
+_lowerKeys = {}
+
+# Get case folded argument map of request (parsed once per request)
+def getArgs(request):
+    try:
+        return request.alpaca_args
+    except AttributeError:
+        pass
+    args = {}
+    if request.args:
+        for rkey in request.args:
+            args[rkey.lower()] = request.args.get(rkey)
+    request.alpaca_args = args
+    return args
 
 
 # Get Argument "key" from request
@@ -32,15 +55,36 @@ def getArg(request, key):
         return request.form.get(key)
     else:
         # Case insensitive for GET requests
-        for rkey,val in request.args.items():
-            if rkey.lower() == key.lower():
-                return request.args.get(rkey)
+        lkey = _lowerKeys.get(key)
+        if lkey is None:
+            lkey = key.lower()
+            _lowerKeys[key] = lkey
+        return getArgs(request).get(lkey)
+
+
+# Get integer argument "key" from request, parsed value is cached on the request
+# raises ValueError or TypeError for invalid or missing arguments
+def getIntArg(request, key):
+    try:
+        ints = request.alpaca_ints
+    except AttributeError:
+        ints = request.alpaca_ints = {}
+    val = ints.get(key)
+    if val is None:
+        val = int(getArg(request, key))
+        ints[key] = val
+    return val
 
 
 # Alpaca error codes
 ALPACA_ERR_OK = 0
 ALPACA_ERR_NOT_IMPLEMENTED = 1024
 ALPACA_ERR_INVALID_VALUE = 1025
+ALPACA_ERR_ACTION_NOT_IMPLEMENTED = 1036
+ALPACA_ERR_DRIVER_TIMEOUT = 0x500   # driver specific error: device call timed out
+
+# HTTP headers of JSON replies
+JSON_HEADERS = {"Content-Type": "application/json; charset=UTF-8"}
 
 AlpacaDeviceTypes = ["camera", "covercalibrator", "dome", "filterwheel", "focuser", "observingconditions", "rotator", "safetymonitor", "switch", "telescope"]
 
@@ -56,18 +100,53 @@ class NotImplementedError(Exception):
         super().__init__(message)
         self.errnr = ALPACA_ERR_NOT_IMPLEMENTED
 
+# Action not implemented exception (results in HTTP code 200)
+class ActionNotImplementedError(NotImplementedError):
+    def __init__(self, message):
+        super().__init__(message)
+        self.errnr = ALPACA_ERR_ACTION_NOT_IMPLEMENTED
+
 # Argument range error (results in HTTP code 200)
 class RangeError(Exception):
     def __init__(self, message):
         super().__init__(message)
         self.errnr = ALPACA_ERR_INVALID_VALUE
 
+# Device call timeout (results in HTTP code 200)
+class DriverTimeoutError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.errnr = ALPACA_ERR_DRIVER_TIMEOUT
+
+
+# render template (for the setup pages of user devices, the template engine is imported on first use)
+def render_template(template, *args, **kwargs):
+    from microdot_utemplate import render_template as render
+    return render(template, *args, **kwargs)
+
+
+# invalidate cached setup page key (all pages if key is None)
+# the page cache is only loaded with the first setup page request, before that nothing is cached
+def invalidatePages(key=None):
+    mod = sys.modules.get("mipyalpaca.alpacapages")
+    if mod is not None:
+        mod.pages.invalidate(key)
+
+
+# True if obj has to be awaited (result of an async def method)
+def isAwaitable(obj):
+    return hasattr(obj, "send")
+
 
 class AlpacaServer:
     __instance = None
     config = {}
     devices = {}
-    wlan = None
+    dispatch = {}  # (device type, device number, HTTP verb, method) -> (device, handler, metrics slot)
+    wlan = None        # WLAN supervisor
+    discovery = None
+    replyWriter = ReplyWriter()
+    callTimeout = 5000  # default timeout of async device calls in ms (0: no timeout)
     ServerTransactionID = 1
     ServerApiVersions = [1]
     ServerName = ""
@@ -92,24 +171,39 @@ class AlpacaServer:
             AlpacaServer.devices[dev] = []
 
         AlpacaServer.config = readJson("servercfg.json") 
+        boot.mark("config")
+        log.configure(AlpacaServer.config)
+        persister.delay = int(AlpacaServer.config.get("persistDelay", persister.delay))
+        AlpacaServer.callTimeout = int(AlpacaServer.config.get("callTimeout", AlpacaServer.callTimeout))
+        stream.configure(AlpacaServer.config)
+        alpaca_app.configure(AlpacaServer.config)
+        metrics.addSource("connections", alpaca_app.metrics)
+        AlpacaServer.discovery = AlpacaDiscovery(self)
+        metrics.enabled = AlpacaServer.config.get("metrics", True)
+        metrics.addSource("discovery", discoveryMetrics)
+        gcManager.start(AlpacaServer.config, connectionsBusy)
+        metrics.addSource("gc", gcManager.metrics)
         uasyncio.create_task(appDiscovery(self))
+        boot.mark("server")
 
 
     # Create reply for request
     @classmethod
-    def reply(cls, request, value=None, err_nr=0, err_msg="", mngmnt_api=False):
+    # encoded True: value is already JSON encoded (see ReplyWriter.encode)
+    def reply(cls, request, value=None, err_nr=0, err_msg="", mngmnt_api=False, encoded=False):
         AlpacaServer.ServerTransactionID+=1   # increment server transaction ID
-        r = {"ServerTransactionID": AlpacaServer.ServerTransactionID, "ErrorNumber": err_nr, "ErrorMessage" : err_msg}
+        if err_nr:
+            request.alpaca_err = err_nr       # error number for request metrics
+        clid = None
+        has_value = (err_nr == 0)
         if not mngmnt_api:
             # return ClientTransactionID of request
             try:
-                clid = getArg(request, "ClientTransactionID")
-                r["ClientTransactionID"] = int(clid)
+                clid = getIntArg(request, "ClientTransactionID")
             except (ValueError, TypeError):
-                return r
-        if err_nr == 0:
-            r["Value"] = value
-        return r
+                has_value = False
+        body = AlpacaServer.replyWriter.reply(AlpacaServer.ServerTransactionID, clid, err_nr, err_msg, value, has_value, encoded)
+        return Response(body, headers=JSON_HEADERS)
 
 
     # install device on Alpaca server
@@ -117,7 +211,30 @@ class AlpacaServer:
         newdevice.device_nr = dev_nr
         AlpacaServer.devices[dev_type].insert(dev_nr, newdevice)
         newdevice.server = self
+        newdevice.installed()
+        AlpacaServer.compileDevice(dev_type, dev_nr, newdevice)
+        stream.addSource(newdevice)
+        invalidatePages()
+        boot.mark(dev_type + " " + str(dev_nr))
+
+    # add all API methods (GET_xxx and PUT_xxx) of a device to the dispatch table
+    # method names are stored in lower case (Alpaca method names are case insensitive)
+    @classmethod
+    def compileDevice(cls, dev_type, dev_nr, dev):
+        for attr in dir(dev):
+            if attr.startswith("GET_") or attr.startswith("PUT_"):
+                handler = getattr(dev, attr)
+                if callable(handler):
+                    method = attr[4:].lower()
+                    slot = metrics.register('device_type="' + dev_type + '",device_number="' + str(dev_nr) +
+                                            '",verb="' + attr[:3] + '",method="' + method + '"')
+                    AlpacaServer.dispatch[(dev_type, dev_nr, attr[:3], method)] = (dev, handler, slot)
         
+    # write server configuration
+    @classmethod
+    def saveConfig(cls):
+        writeJson("servercfg.json", AlpacaServer.config)
+
     # return server API versions    
     @classmethod
     def getServerApiVersions(cls):
@@ -138,83 +255,104 @@ class AlpacaServer:
         return {"ServerName":AlpacaServer.ServerName, "Manufacturer":AlpacaServer.Manufacturer, "ManufacturerVersion":AlpacaServer.ManfVersion, "Location":AlpacaServer.ManfLocation}
 
     # call API method from request
+    # handlers may return an awaitable (async def), it is awaited with the call timeout of the device
     @classmethod
-    def callMethod(cls, dev_type, dev_nr, method, request):
-        
-        if dev_type not in AlpacaServer.devices:
-            return "Device type "+dev_type+" not implemented", 400
-        if (dev_nr >= len(AlpacaServer.devices[dev_type])) or (dev_nr < 0):
-            return "Device "+dev_type+" "+str(dev_nr)+" not installed", 400
-        if not hasattr(AlpacaServer.devices[dev_type][dev_nr], request.method+"_"+method):    
-            return "Device "+dev_type+" "+str(dev_nr)+" not installed", 400
+    async def callMethod(cls, dev_type, dev_nr, method, request):
+        entry = AlpacaServer.dispatch.get((dev_type, dev_nr, request.method, method))
+        if entry is None:
+            # retry with lower case method name
+            entry = AlpacaServer.dispatch.get((dev_type, dev_nr, request.method, method.lower()))
+            if entry is None:
+                if dev_type not in AlpacaServer.devices:
+                    return "Device type "+dev_type+" not implemented", 400
+                return "Device "+dev_type+" "+str(dev_nr)+" not installed", 400
+        dev, handler, request.alpaca_slot = entry
             
         try:
             # call the requested method
-            return getattr(AlpacaServer.devices[dev_type][dev_nr], request.method+"_"+method)(request)
+            res = handler(request)
+            if isAwaitable(res):
+                timeout = dev.callTimeout
+                if timeout is None:
+                    timeout = AlpacaServer.callTimeout
+                if timeout > 0:
+                    try:
+                        res = await uasyncio.wait_for_ms(res, timeout)
+                    except uasyncio.TimeoutError:
+                        log.warning("%s %d %s timed out", (dev_type, dev_nr, method))
+                        raise DriverTimeoutError(method + " timed out after " + str(timeout) + " ms")
+                else:
+                    res = await res
+            return res
         except CallArgError as e:
             return str(e), 400
         except RangeError as e:
-            return AlpacaServer.devices[dev_type][dev_nr].reply(request, "", e.errnr, str(e))
+            return dev.reply(request, "", e.errnr, str(e))
         except NotImplementedError as e:
-            return AlpacaServer.devices[dev_type][dev_nr].reply(request, "", e.errnr, str(e))
+            return dev.reply(request, "", e.errnr, str(e))
+        except DriverTimeoutError as e:
+            return dev.reply(request, "", e.errnr, str(e))
 
 
     # start Microdot Alpaca server
     @classmethod
     async def startServer(cls):
-            await alpaca_app.start_server(port=int(AlpacaServer.config["serverPort"]), debug=True)
+            boot.mark("http")
+            await alpaca_app.start_server(port=int(AlpacaServer.config["serverPort"]))
             
             
-    # connect to WLAN in station mode            
+    # connect to WLAN in station mode (in background, reconnects after link loss)
     @classmethod
     def connectStationMode(cls, ssid, password):
-        wlan = network.WLAN(network.STA_IF)
-
-        if not wlan.isconnected():
-            print('Connecting to ' + ssid, end=' ')
-            wlan.active(True)
-            wlan.connect(ssid, password)
-            while not wlan.isconnected():
-                pass
-        print('\nConnected to IP address ' + wlan.ifconfig()[0])
+        AlpacaServer.startWlan(WlanSupervisor(ssid, password, False, AlpacaServer.config))
 
 
-    # Start as WLAN access point
+    # Start as WLAN access point (in background)
     @classmethod
     def startAccessPoint(cls, ssid, password):
-        wlan = network.WLAN(network.AP_IF)
-        
-        wlan.config(essid=ssid, password=password)
-        wlan.active(True)
+        AlpacaServer.startWlan(WlanSupervisor(ssid, password, True, AlpacaServer.config))
+
 
-        while wlan.active() == False:
-          pass
-        print('\nAccessPoint active, IP address ' + wlan.ifconfig()[0])
+    # start WLAN supervisor, discovery sockets are re-armed after every (re)connect
+    @classmethod
+    def startWlan(cls, supervisor):
+        AlpacaServer.wlan = supervisor
+        supervisor.onConnect.append(AlpacaServer.discovery.rearm)
+        metrics.addSource("wlan", supervisor.metrics)
+        supervisor.start()
 
 
 # Alpaca discovery daemon
 async def appDiscovery(server):
-    srv = server
-    s=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.bind(('',int(srv.config["discoveryPort"])))
+    AlpacaServer.discovery.start()
+
 
-    print("Start Discovery")
-    poller = uselect.poll()
-    poller.register(s, uselect.POLLIN)        
+# discovery packet counters in Prometheus text format
+def discoveryMetrics():
+    disc = AlpacaServer.discovery
+    yield "# TYPE alpaca_discovery_packets_total counter\n"
+    yield "alpaca_discovery_packets_total{result=\"received\"} " + str(disc.received) + "\n"
+    yield "alpaca_discovery_packets_total{result=\"replied\"} " + str(disc.replied) + "\n"
+    yield "alpaca_discovery_packets_total{result=\"dropped\"} " + str(disc.dropped) + "\n"
 
-    while True:
-       # poll for discovery broadcasts 
-       evts = poller.poll(0)
-       for sock, evt in evts:
-           if evt and uselect.POLLIN:
-               # received discovery broadcast
-               print("Broadcast received")
-               data, address=s.recvfrom(1024)
-               # reply with own port
-               send_data = "{\n   \"AlpacaPort\":"+srv.config["serverPort"]+"\n}"
-               s.sendto(send_data.encode('utf-8'), address)
-       await uasyncio.sleep_ms(10)
 
+# busy state for the GC manager: connections being handled (without idle change stream
+# subscribers) and time of the last finished connection
+def connectionsBusy():
+    return alpaca_app.active - len(stream.subscribers), alpaca_app.lastActivity
+
+
+# record request metrics of a route (decorator below the route decorator)
+def metered(route):
+    slot = metrics.register('route="' + route + '"')
+    def decorator(fct):
+        async def wrapper(request, *args, **kwargs):
+            t0 = utime.ticks_us()
+            res = await fct(request, *args, **kwargs)
+            metrics.observe(slot, t0, res, getattr(request, "alpaca_err", 0))
+            return res
+        return wrapper
+    return decorator
 
 
 Response.default_content_type = 'text/html'
@@ -222,19 +360,20 @@ Response.default_content_type = 'text/html'
 # API call
 @alpaca_app.route('/api/v1/<devtype>/<int:devnr>/<method>', methods=['GET', 'PUT'])
 async def apicall(request,devtype,devnr,method):
+    t0 = utime.ticks_us()
+    res = await checkedCall(request,devtype,devnr,method)
+    metrics.observe(getattr(request, "alpaca_slot", metrics.unknownSlot), t0, res, getattr(request, "alpaca_err", 0))
+    return res
+
+# check client IDs and call API method
+async def checkedCall(request,devtype,devnr,method):
     try: # check ClientID
-        clid_arg = getArg(request, "ClientID")
-        if clid_arg == None:
-            return "Invalid ClientID", 400
-        clid = int(clid_arg)
+        clid = getIntArg(request, "ClientID")
     except (ValueError, TypeError):
         return "Invalid ClientID", 400
 
     try: # check ClientTransactionID
-        trid_arg = getArg(request, "ClientTransactionID")
-        if trid_arg == None:
-            return "Invalid ClientTransactionID", 400
-        trid = int(trid_arg)
+        trid = getIntArg(request, "ClientTransactionID")
     except (ValueError, TypeError):
         return "Invalid ClientTransactionID", 400
 
@@ -243,7 +382,15 @@ async def apicall(request,devtype,devnr,method):
     if (trid < 0):
         return "Invalid ClientTransactionID", 400
     
-    return AlpacaServer.callMethod(devtype, devnr, method, request)
+    return await AlpacaServer.callMethod(devtype, devnr, method, request)
+
+# change stream of switch values (Server-Sent Events)
+@alpaca_app.get('/stream/v1/changes')
+async def get_stream_changes(request):
+    sub = stream.subscribe()
+    if sub is None:
+        return "Too many stream clients", 503
+    return StreamResponse(sub)
 
 # root page, redirect to server setup page
 @alpaca_app.route('/')
@@ -257,25 +404,67 @@ async def devsetup(request,devtype,devnr):
 
 # return server API versions
 @alpaca_app.get('/management/apiversions')
+@metered('/management/apiversions')
 async def get_mgmt_apiversions(request):
     return AlpacaServer.reply(request, AlpacaServer.getServerApiVersions(), mngmnt_api=True)
 
 # return server description
 @alpaca_app.get('/management/v1/description')
+@metered('/management/v1/description')
 async def get_mgmt_description(request):
     return AlpacaServer.reply(request, AlpacaServer.getServerDescr(), mngmnt_api=True)
 
 # return configured devices
 @alpaca_app.get('/management/v1/configureddevices')
+@metered('/management/v1/configureddevices')
 async def get_mgmt_configureddevices(request):
     return AlpacaServer.reply(request, AlpacaServer.getConfDevices(), mngmnt_api=True)
 
-# server setup page
+# render server setup page
+def renderSetupPage():
+    return render_template('mipysetup.html', title="RasPi Pico Alpaca Server Setup", tab = AlpacaServer.getConfDevices(), srvcfg = AlpacaServer.config)
+
+# server setup page (page cache is imported on first use)
 @alpaca_app.route('/setup', methods=['GET', 'POST'])
 async def setup(req):
+    from mipyalpaca.alpacapages import pages
     if req.method == 'POST':  # apply new settings on POST
         AlpacaServer.config["serverPort"] = req.form.get('srvport')
         AlpacaServer.config["discoveryPort"] = req.form.get('discport')
-        writeJson("servercfg.json", AlpacaServer.config)
-    # render server setup page    
-    return render_template('mipysetup.html', title="RasPi Pico Alpaca Server Setup", tab = AlpacaServer.getConfDevices(), srvcfg = AlpacaServer.config)
+        persister.markDirty("servercfg.json", AlpacaServer.saveConfig)
+        pages.invalidate("setup")
+    # server setup page (cached)
+    return pages.respond(req, "setup", renderSetupPage)
+
+# return WLAN connection state
+@alpaca_app.get('/management/v1/wlan')
+@metered('/management/v1/wlan')
+async def get_mgmt_wlan(request):
+    if AlpacaServer.wlan is None:
+        return AlpacaServer.reply(request, {"State": "unmanaged"}, mngmnt_api=True)
+    return AlpacaServer.reply(request, AlpacaServer.wlan.status(), mngmnt_api=True)
+
+# log records in text format, optional arguments since (first sequence number) and level
+@alpaca_app.get('/management/v1/log')
+async def get_mgmt_log(request):
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        since = 0
+    level = LogLevels.get(request.args.get("level", "").upper(), 0)
+    return log.render(since, level), 200, {"Content-Type": "text/plain"}
+
+# boot phases in ms since reset
+@alpaca_app.get('/management/v1/boot')
+@metered('/management/v1/boot')
+async def get_mgmt_boot(request):
+    return AlpacaServer.reply(request, boot.report(), mngmnt_api=True)
+
+# request metrics in Prometheus text format
+@alpaca_app.get('/management/v1/metrics')
+async def get_mgmt_metrics(request):
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+# server modules and routes are loaded
+boot.mark("imports")
@@ -0,0 +1,120 @@
+import uasyncio
+import ujson
+import utime
+import os
+from mipyalpaca.alpacagc import gcManager
+from mipyalpaca.alpacalog import log
+
+
+# Write file atomically (write temp file, then rename it to filename)
+def writeFileAtomic(filename, data):
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as fp:
+        fp.write(data)
+    try:
+        os.rename(tmp, filename)
+    except OSError:
+        # file system cannot replace existing files on rename (e.g. FAT)
+        os.remove(filename)
+        os.rename(tmp, filename)
+    gcManager.collectSoon()
+
+
+# Recover file from temp file if a write was interrupted between remove and rename
+# returns True if the file has been recovered
+def recoverFile(filename):
+    try:
+        os.stat(filename)
+        return False
+    except OSError:
+        pass
+    try:
+        os.rename(filename + ".tmp", filename)
+        return True
+    except OSError:
+        return False
+
+
+# Debounced persistence of configuration and state files
+# writers are registered as dirty and run in one background flush after a quiet period
+class Persister:
+
+    def __init__(self, delay=2000):
+        self.delay = delay       # quiet period in ms before dirty data is written
+        self.dirty = {}          # key -> writer function of dirty data
+        self.lastChange = 0      # time of last change
+        self.task = None         # running flush task
+
+
+    # mark data as dirty, writer() is called on next flush
+    def markDirty(self, key, writer):
+        self.dirty[key] = writer
+        self.lastChange = utime.ticks_ms()
+        if self.task is None:
+            self.task = uasyncio.create_task(self.run())
+
+
+    # write all dirty data now
+    # failed writers stay dirty and are retried after the next quiet period
+    def flush(self):
+        dirty = self.dirty
+        self.dirty = {}
+        for key, writer in dirty.items():
+            try:
+                writer()
+            except Exception as e:
+                log.error("Writing %s failed: %s", (key, repr(e)))
+                if key not in self.dirty:
+                    self.markDirty(key, writer)
+
+
+    # flush task, waits until no change occurred for the quiet period
+    async def run(self):
+        while True:
+            wait = self.delay - utime.ticks_diff(utime.ticks_ms(), self.lastChange)
+            if wait <= 0:
+                break
+            await uasyncio.sleep_ms(wait)
+        self.task = None
+        self.flush()
+
+
+# Wear levelling snapshot of a list of values
+# snapshots are written round robin into nslots files, the newest valid snapshot is loaded
+class StateSlots:
+
+    def __init__(self, basename, nslots):
+        self.basename = basename   # base name of slot files
+        self.nslots = nslots       # number of slot files
+        self.seq = 0               # sequence number of latest snapshot
+
+
+    # return file name of slot
+    def slotName(self, slot):
+        return self.basename + ".s" + str(slot)
+
+
+    # load newest valid snapshot, returns None if there is none
+    def load(self):
+        values = None
+        for slot in range(self.nslots):
+            try:
+                with open(self.slotName(slot)) as fp:
+                    snap = ujson.load(fp)
+                if snap["seq"] > self.seq or values is None:
+                    self.seq = snap["seq"]
+                    values = snap["values"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        return values
+
+
+    # write snapshot into next slot
+    def save(self, values):
+        self.seq += 1
+        writeFileAtomic(self.slotName(self.seq % self.nslots),
+                        ujson.dumps({"seq": self.seq, "values": list(values)}))
+
+
+# persister of the Alpaca server
+persister = Persister()
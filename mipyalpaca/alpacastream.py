@@ -0,0 +1,147 @@
+import uasyncio
+import ujson
+from microdot_asyncio import Response
+from mipyalpaca.alpacalog import log
+
+
+# HTTP headers of the event stream
+SSE_HEADERS = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+
+
+# Subscriber of the change stream, body of the streaming response (Server-Sent Events)
+# pending changes are coalesced per switch, a slow client only receives the latest values
+class StreamSubscriber:
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.pending = {}                # (device type, device number, id) -> value
+        self.event = uasyncio.Event()    # set when changes are pending
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    # wait for changes and return them as one chunk of events
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        if not self.pending:
+            try:
+                await uasyncio.wait_for_ms(self.event.wait(), self.hub.keepalive)
+            except uasyncio.TimeoutError:
+                return b": keepalive\n\n"
+        self.event.clear()
+        pending = self.pending
+        self.pending = {}
+        chunk = ""
+        for (devtype, devnr, id), value in pending.items():
+            chunk += ('data: {"dev":"' + devtype + '","n":' + str(devnr) + ',"id":' + str(id) +
+                      ',"v":' + ujson.dumps(value) + '}\n\n')
+        return chunk
+
+    # queue change
+    def push(self, key, value):
+        self.pending[key] = value
+        self.event.set()
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+
+# Streaming response, unsubscribes when the connection is closed
+class StreamResponse(Response):
+
+    def __init__(self, subscriber):
+        super().__init__(subscriber, headers=SSE_HEADERS)
+        self.subscriber = subscriber
+
+    async def write(self, stream):
+        try:
+            await super().write(stream)
+        finally:
+            self.subscriber.close()
+
+
+# Change stream of switch values
+# set requests are published by the devices, read-only values (inputs, ADC, sensors)
+# are polled by a watcher task while clients are subscribed
+class ChangeStream:
+
+    def __init__(self):
+        self.subscribers = []   # connected clients
+        self.sources = []       # devices with pollChanges() and snapshot()
+        self.maxClients = 2     # maximum number of subscribers (0: stream disabled)
+        self.pollInterval = 100 # poll period of the watcher in ms
+        self.keepalive = 15000  # keepalive comment period in ms
+        self.task = None        # watcher task
+        self.failing = []       # sources whose last poll failed (logged once until they recover)
+
+
+    # apply server configuration
+    def configure(self, config):
+        self.maxClients = int(config.get("streamMaxClients", self.maxClients))
+        self.pollInterval = int(config.get("streamPoll", self.pollInterval))
+        self.keepalive = int(config.get("streamKeepalive", self.keepalive))
+
+
+    # add device as source of changes
+    def addSource(self, dev):
+        self.sources.append(dev)
+
+
+    # new subscriber, returns None if no further client is accepted
+    # the first chunk sent to the client contains the current values of all switches
+    def subscribe(self):
+        if len(self.subscribers) >= self.maxClients:
+            return None
+        sub = StreamSubscriber(self)
+        for src in self.sources:
+            for devtype, devnr, id, value in src.snapshot():
+                sub.push((devtype, devnr, id), value)
+        self.subscribers.append(sub)
+        if self.task is None:
+            self.task = uasyncio.create_task(self.run())
+        return sub
+
+
+    def unsubscribe(self, sub):
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
+
+
+    # publish changed value to all subscribers
+    def publish(self, devtype, devnr, id, value):
+        key = (devtype, devnr, id)
+        for sub in self.subscribers:
+            sub.push(key, value)
+
+
+    # watcher task, runs while clients are subscribed
+    # a failing source is logged and polled again in the next period, the other sources are not affected
+    async def run(self):
+        try:
+            while self.subscribers:
+                for src in self.sources:
+                    self.poll(src)
+                await uasyncio.sleep_ms(self.pollInterval)
+        finally:
+            self.task = None
+
+
+    # poll changes of one source
+    def poll(self, src):
+        try:
+            src.pollChanges()
+        except Exception as e:
+            if src not in self.failing:
+                self.failing.append(src)
+                log.error("Change stream poll failed: %s", repr(e))
+            return
+        if src in self.failing:
+            self.failing.remove(src)
+            log.info("Change stream poll recovered")
+
+
+# change stream of the Alpaca server
+stream = ChangeStream()
@@ -1,5 +1,25 @@
+import ujson
+import uasyncio
 from mipyalpaca.alpacaserver import *
 from mipyalpaca.alpacadevice import AlpacaDevice
+from mipyalpaca.alpacastore import persister, StateSlots
+from mipyalpaca.alpacastream import stream
+from mipyalpaca.alpacacache import ReadCache
+from mipyalpaca.alpacaswitchcfg import SwitchConfig, FLOAT_TYPE, num
+from array import array
+
+# switch state of a bulk action item: JSON bool or Alpaca "true"/"false" string (None if invalid)
+def parseState(state):
+    if (state is True) or (state is False):
+        return state
+    if type(state) is str:
+        s = state.lower()
+        if s == "true":
+            return True
+        if s == "false":
+            return False
+    return None
+
 
 # ASCOM Alpaca switch device
 class SwitchDevice(AlpacaDevice):
@@ -8,17 +28,173 @@ class SwitchDevice(AlpacaDevice):
         super().__init__(devnr, devname, uniqueid)
         self.interfaceVersion = 2   # this implementation supports switch interface version 2
         self.maxswitch = 0  # number of switches
-        self.switchdescr = []  # switch configuration0
-        self.switchValue = []  # current switch values
+        self.descr = None        # JSON switch configuration (see switchdescr)
+        self.swcfg = None        # compiled switch configuration
+        self.switchValue = None  # current switch values (typed array)
         self.driverinfo = "MicroPython ASCOM Alpaca Switch Driver" # switch driver MiPy
         self.driverVersion = "v0.90"   # driver version
         self.configfile = config_file  # name of JSON file with switch config
+        self.stateSlots = None         # snapshot slots of switch values (None: not persistent)
+        self.stateKey = config_file + ".state"  # persister key of switch values
+        self.saveStateFct = self.saveState      # bound writer functions for persister
+        self.saveConfigFct = self.saveConfig
 
         self.switchdescr = readJson(self.configfile)  # load switch configuration
         self.maxswitch = len(self.switchdescr)        # get number of switches
-        # create initial list of switch values
-        for i in range(self.maxswitch):
-            self.switchValue.append(0)               
+        self.swcfg = SwitchConfig(self.switchdescr)   # compile switch configuration
+        # create initial switch values
+        self.switchValue = array(FLOAT_TYPE, [0] * self.maxswitch)
+
+        # change stream: last published values (list: edge counters have to compare exactly)
+        self.lastNotified = [0] * self.maxswitch
+        self.notified = bytearray(self.maxswitch)     # 1 if a value has been published
+        self.streamIds = None                         # switches checked by pollChanges (built on first poll)
+
+        # read cache of switches with "cachettl" (None if no switch is cached)
+        self.readCache = ReadCache(self.swcfg.ttl) if any(self.swcfg.ttl) else None
+
+        # bulk actions
+        self.addAction("GetSwitchValues", self.actionGetSwitchValues)
+        self.addAction("GetAllSwitches", self.actionGetAllSwitches)
+        self.addAction("SetSwitchValues", self.actionSetSwitchValues)
+
+
+    # JSON switch configuration, released after installation and read again from the
+    # config file if a subclass still uses it (kept from then on)
+    @property
+    def switchdescr(self):
+        if self.descr is None:
+            self.descr = readJson(self.configfile)
+        return self.descr
+
+    @switchdescr.setter
+    def switchdescr(self, descr):
+        self.descr = descr
+
+
+    # enable persistence of switch values if configured on the server, restore last values
+    # the JSON switch configuration is released (compiled into swcfg)
+    def installed(self):
+        nslots = int(self.server.config.get("stateSlots", 0))
+        if nslots > 0:
+            self.stateSlots = StateSlots(self.configfile, nslots)
+            self.restoreState()
+        self.descr = None
+
+
+    # restore last saved values of writable switches
+    def restoreState(self):
+        values = self.stateSlots.load()
+        if (values is None) or (len(values) != self.maxswitch):
+            return
+        for id in range(self.maxswitch):
+            if self.swcfg.canwrite(id):
+                res = self.setswitchvalue(id, values[id])
+                if isAwaitable(res):
+                    uasyncio.create_task(res)
+
+
+    # write snapshot of switch values
+    def saveState(self):
+        self.stateSlots.save([self.stateValue(id) for id in range(self.maxswitch)])
+
+
+    # value of switch id in the state snapshot
+    # (might be overwritten for switches whose exact value is not kept in switchValue)
+    def stateValue(self, id):
+        return num(self.switchValue[id])
+
+
+    # encode static switch metadata for the metadata cache
+    # (the per switch metadata is replied from the compiled switch configuration)
+    def buildMetaCache(self):
+        cache = super().buildMetaCache()
+        cache["maxswitch"] = AlpacaServer.replyWriter.encode(self.maxswitch)
+        return cache
+
+
+    # reload switch metadata (names, descriptions, limits, deadbands) from config file
+    # the pin and read cache configuration is applied on restart only
+    def reloadConfig(self):
+        descr = readJson(self.configfile)
+        if len(descr) != self.maxswitch:
+            raise ValueError("Number of switches changed, restart required")
+        self.swcfg = SwitchConfig(descr)
+        self.descr = None
+        self.streamIds = None
+        self.invalidateMetaCache()
+
+
+    # write switch configuration (switch names changed by clients)
+    def saveConfig(self):
+        descr = readJson(self.configfile)
+        for id in range(self.maxswitch):
+            descr[id]["name"] = self.swcfg.name(id)
+        writeJson(self.configfile, descr)
+
+
+    # switch value has been changed by a client
+    def stateChanged(self, id):
+        if self.readCache is not None:
+            self.readCache.invalidate(id)
+        if self.stateSlots is not None:
+            persister.markDirty(self.stateKey, self.saveStateFct)
+        self.notify(id, num(self.switchValue[id]))
+
+
+    # publish switch value to the change stream
+    def notify(self, id, value):
+        self.lastNotified[id] = value
+        self.notified[id] = 1
+        stream.publish("switch", self.device_nr, id, value)
+
+
+    # switch value for the change stream (async hooks are not awaited, last stored value is used)
+    def streamValue(self, id):
+        if self.readCache is not None:
+            v = self.readCache.peek(id)
+            if v is not None:
+                return v
+        v = self.getswitchvalue(id)
+        if isAwaitable(v):
+            v.close()
+            v = num(self.switchValue[id])
+        return v
+
+
+    # current values of all switches for new stream subscribers
+    def snapshot(self):
+        for id in range(self.maxswitch):
+            v = self.streamValue(id)
+            self.lastNotified[id] = v
+            self.notified[id] = 1
+            yield ("switch", self.device_nr, id, v)
+
+
+    # True if the change stream polls switch id (might be overwritten for user specific switches)
+    # writable switches are published by the set requests, read-only user defined switches are
+    # only polled if cached (no hardware read), otherwise they have to call notify(id, value)
+    def streamPolled(self, id):
+        return (not self.swcfg.canwrite(id)) and (self.swcfg.ttl[id] > 0)
+
+
+    # publish polled switches whose value moved past their deadband (inputs, ADC, sensors)
+    # cached switches are checked with their cached value, expired entries are skipped
+    def pollChanges(self):
+        if self.streamIds is None:
+            self.streamIds = [id for id in range(self.maxswitch) if self.streamPolled(id)]
+        last = self.lastNotified
+        deadband = self.swcfg.deadband
+        ttl = self.swcfg.ttl
+        for id in self.streamIds:
+            if ttl[id] > 0:
+                v = self.readCache.peek(id)
+                if v is None:
+                    continue
+            else:
+                v = self.streamValue(id)
+            if (not self.notified[id]) or ((v != last[id]) and (abs(v - last[id]) >= deadband[id])):
+                self.notify(id, v)
 
 
     # get switch id from request
@@ -40,43 +216,80 @@ class SwitchDevice(AlpacaDevice):
 
 
     # get switch value (might be overwritten for user specific switches)
+    # the get/set hooks might be overwritten by async def methods (e.g. for slow sensors)
     def getswitchvalue(self, id):
-        return self.switchValue[id]
+        return num(self.switchValue[id])
+
+    # switch value through the read cache
+    def readValue(self, id):
+        if self.readCache is None:
+            return self.getswitchvalue(id)
+        return self.readCache.get(id, self.getswitchvalue)
 
     # request for switch value
     def GET_getswitchvalue(self, request):
         id = self.getSwitchId(request)
-        return self.reply(request, self.getswitchvalue(id))    
+        v = self.readValue(id)
+        if isAwaitable(v):
+            return self.replyAsync(request, v)
+        return self.reply(request, v)
 
     # get boolean switch value (might be overwritten for user specific switches)
     def getswitch(self, id):
         return bool(self.switchValue[id])
 
+    # boolean switch value, derived from the cached switch value for cached switches
+    def readState(self, id):
+        if (self.readCache is None) or (self.readCache.ttl[id] == 0):
+            return self.getswitch(id)
+        v = self.readCache.get(id, self.getswitchvalue)
+        if isAwaitable(v):
+            return self.awaitState(v)
+        return bool(v)
+
+    async def awaitState(self, aw):
+        return bool(await aw)
+
     # request for boolean switch value
     def GET_getswitch(self, request):
         id = self.getSwitchId(request)
-        return self.reply(request, self.getswitch(id))
+        v = self.readState(id)
+        if isAwaitable(v):
+            return self.replyAsync(request, v)
+        return self.reply(request, v)
 
     # set switch value (might be overwritten for user specific switches)
     def setswitchvalue(self, id, value):
         self.switchValue[id] = value
+
+    # reply to set request after async set hook has finished
+    async def replySetAsync(self, request, aw, id):
+        await aw
+        self.stateChanged(id)
+        return self.reply(request, "")
     
+    # range check of switch value (rejects nan as well, it fails every comparison)
+    def checkSwitchValue(self, id, v):
+        if not ((v >= self.swcfg.minv[id]) and (v <= self.swcfg.maxv[id])):
+           raise RangeError("Value of switch "+str(id)+" out of range or missing")
+
     # request for setting switch value
     def PUT_setswitchvalue(self, request):
         id = self.getSwitchId(request)
         # raise exception for non-writable switches        
-        if self.switchdescr[id]["canwrite"] == False:
+        if not self.swcfg.canwrite(id):
             raise NotImplementedError("Device cannot be written to")
         
         if request.form.get('Value') is None:
             raise CallArgError("Invalid or missing switch value")
         
         v = float(request.form.get("Value"))
-        # range check
-        if (v < self.switchdescr[id]["min"]) or (v > self.switchdescr[id]["max"]):
-           raise RangeError("Value of switch "+str(id)+" out of range or missing")
+        self.checkSwitchValue(id, v)
 
-        self.setswitchvalue(id, v)
+        res = self.setswitchvalue(id, v)
+        if isAwaitable(res):
+            return self.replySetAsync(request, res, id)
+        self.stateChanged(id)
         return self.reply(request, "")
 
 
@@ -89,53 +302,121 @@ class SwitchDevice(AlpacaDevice):
         id = self.getSwitchId(request)
 
         # raise exception for non-writable switches        
-        if self.switchdescr[id]["canwrite"] == False:
+        if not self.swcfg.canwrite(id):
             raise NotImplementedError("Device cannot be written to")
 
         if request.form.get("State") == "True":
-            self.setswitch(id, 1)
+            res = self.setswitch(id, 1)
         else:
             if request.form.get("State") == "False":
-                self.setswitch(id, 0)
+                res = self.setswitch(id, 0)
             else:
                 raise CallArgError("Invalid or missing switch state")
+        if isAwaitable(res):
+            return self.replySetAsync(request, res, id)
+        self.stateChanged(id)
         return self.reply(request, "")
 
     # return number of switches
     def GET_maxswitch(self, request):
-        return self.reply(request, self.maxswitch)
+        return self.replyMeta(request, "maxswitch")
 
     # return switch name
     def GET_getswitchname(self, request):
-        return self.reply(request, self.switchdescr[int(self.getSwitchId(request))]["name"])
+        return AlpacaServer.reply(request, self.swcfg.nameJson(self.getSwitchId(request)), encoded=True)
     
     # set new switch name
     def PUT_setswitchname(self, request):
         if request.form.get('Name') is None:
             raise CallArgError("Invalid or missing switch name")
-        self.switchdescr[self.getSwitchId(request)]["name"] = request.form.get('Name')
-        # write value to config file
-        writeJson(self.configfile, self.switchdescr)
+        self.swcfg.setName(self.getSwitchId(request), request.form.get('Name'))
+        self.invalidateMetaCache()
+        # write value to config file (delayed)
+        persister.markDirty(self.configfile, self.saveConfigFct)
         return self.reply(request)
 
     # return "canwrite" flag
     def GET_canwrite(self, request):
-        return self.reply(request, self.switchdescr[self.getSwitchId(request)]["canwrite"])
+        return self.reply(request, self.swcfg.canwrite(self.getSwitchId(request)))
 
     # return switch description
     def GET_getswitchdescription(self, request):
-        return self.reply(request, self.switchdescr[self.getSwitchId(request)]["descr"])
+        return AlpacaServer.reply(request, self.swcfg.descrJson(self.getSwitchId(request)), encoded=True)
 
     # return minimum switch value
     def GET_minswitchvalue(self, request):
-        return self.reply(request, self.switchdescr[self.getSwitchId(request)]["min"])
+        return self.reply(request, self.swcfg.min(self.getSwitchId(request)))
 
     # return maximum switch value
     def GET_maxswitchvalue(self, request):
-        return self.reply(request, self.switchdescr[self.getSwitchId(request)]["max"])
+        return self.reply(request, self.swcfg.max(self.getSwitchId(request)))
 
     # return switch step size
     def GET_switchstep(self, request):
-        return self.reply(request, self.switchdescr[self.getSwitchId(request)]["step"])
+        return self.reply(request, self.swcfg.step(self.getSwitchId(request)))
+
 
+    # call get/set hook, await it if it is an async hook
+    async def callHook(self, fct, *args):
+        res = fct(*args)
+        if isAwaitable(res):
+            res = await res
+        return res
 
+    # action GetSwitchValues: value and state of all switches (JSON list)
+    async def actionGetSwitchValues(self, parameters):
+        r = []
+        for id in range(self.maxswitch):
+            r.append({"Id": id, "Value": await self.callHook(self.readValue, id),
+                      "State": await self.callHook(self.readState, id)})
+        return ujson.dumps(r)
+
+    # action GetAllSwitches: value, state and metadata of all switches (JSON list)
+    async def actionGetAllSwitches(self, parameters):
+        r = []
+        for id in range(self.maxswitch):
+            cfg = self.swcfg
+            r.append({"Id": id, "Name": cfg.name(id), "Description": cfg.descr(id),
+                      "Value": await self.callHook(self.readValue, id),
+                      "State": await self.callHook(self.readState, id),
+                      "Min": cfg.min(id), "Max": cfg.max(id), "Step": cfg.step(id), "CanWrite": cfg.canwrite(id)})
+        return ujson.dumps(r)
+
+    # action SetSwitchValues: set several switches, parameters is a JSON list of
+    # {"Id": id, "Value": value} or {"Id": id, "State": true/false}
+    # all switches are checked before the first one is set
+    # (missing parameters are a call error, invalid parameters are reported as InvalidValue)
+    async def actionSetSwitchValues(self, parameters):
+        if parameters is None:
+            raise CallArgError("Missing parameters")
+        try:
+            items = ujson.loads(parameters)
+            if type(items) is not list:
+                raise TypeError()
+            updates = []
+            for item in items:
+                id = int(item["Id"])
+                if "State" in item:
+                    updates.append((id, None, parseState(item["State"])))
+                else:
+                    updates.append((id, float(item["Value"]), None))
+        except (ValueError, TypeError, KeyError):
+            raise RangeError("Invalid switch value parameters")
+
+        for id, v, state in updates:
+            if (id < 0) or (id >= self.maxswitch):
+                raise RangeError("Switch ID out of range")
+            if not self.swcfg.canwrite(id):
+                raise NotImplementedError("Switch " + str(id) + " cannot be written to")
+            if v is not None:
+                self.checkSwitchValue(id, v)
+            elif state is None:
+                raise RangeError("Invalid state of switch " + str(id))
+
+        for id, v, state in updates:
+            if v is None:
+                await self.callHook(self.setswitch, id, 1 if state else 0)
+            else:
+                await self.callHook(self.setswitchvalue, id, v)
+            self.stateChanged(id)
+        return ""
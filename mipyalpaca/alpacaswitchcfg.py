@@ -0,0 +1,85 @@
+import ujson
+from array import array
+
+
+# typecode of float arrays: "d" on ports with double precision floats, "f" otherwise
+FLOAT_TYPE = "d" if 1.0 + 1e-9 != 1.0 else "f"
+
+# switch flags
+SW_CANWRITE = 1
+
+
+# return integral float values as int (keeps the JSON encoding of the config file, e.g. 1 instead of 1.0)
+# non-finite values (nan, inf) are returned unchanged
+def num(v):
+    if v - v != 0.0:
+        return v
+    i = int(v)
+    return i if i == v else v
+
+
+# Compiled switch configuration
+# the JSON switch configuration (list of dicts) is compiled into typed arrays and one
+# bytes object with the JSON encoded names and descriptions, so the resident switch
+# metadata takes a few heap objects per device instead of dozens per switch;
+# the JSON file stays the editable source format
+class SwitchConfig:
+
+    def __init__(self, descr):
+        self.n = len(descr)
+        self.minv = array(FLOAT_TYPE, [float(sw["min"]) for sw in descr])                  # minimum values
+        self.maxv = array(FLOAT_TYPE, [float(sw["max"]) for sw in descr])                  # maximum values
+        self.stepv = array(FLOAT_TYPE, [float(sw["step"]) for sw in descr])                # step sizes
+        self.deadband = array(FLOAT_TYPE, [float(sw.get("deadband", 0)) for sw in descr])  # change stream deadbands
+        self.ttl = array("L", [int(sw.get("cachettl", 0)) for sw in descr])                # read cache TTLs in ms
+        self.flags = bytearray([SW_CANWRITE if sw["canwrite"] else 0 for sw in descr])
+        self.setText([sw["name"] for sw in descr], [sw["descr"] for sw in descr])
+
+
+    # store JSON encoded names and descriptions in one bytes object
+    # text k (name of switch id: 2 * id, description: 2 * id + 1) is text[offs[k]:offs[k + 1]]
+    def setText(self, names, descrs):
+        offs = array("L", [0] * (2 * self.n + 1))
+        parts = []
+        pos = 0
+        for id in range(self.n):
+            for k, s in ((2 * id, names[id]), (2 * id + 1, descrs[id])):
+                enc = ujson.dumps(s).encode()
+                parts.append(enc)
+                pos += len(enc)
+                offs[k + 1] = pos
+        self.text = b"".join(parts)
+        self.offs = offs
+
+
+    # JSON encoded name of switch id (memoryview, no copy)
+    def nameJson(self, id):
+        return memoryview(self.text)[self.offs[2 * id]:self.offs[2 * id + 1]]
+
+    # JSON encoded description of switch id (memoryview, no copy)
+    def descrJson(self, id):
+        return memoryview(self.text)[self.offs[2 * id + 1]:self.offs[2 * id + 2]]
+
+    def name(self, id):
+        return ujson.loads(bytes(self.nameJson(id)))
+
+    def descr(self, id):
+        return ujson.loads(bytes(self.descrJson(id)))
+
+    # change name of switch id
+    def setName(self, id, name):
+        names = [self.name(i) for i in range(self.n)]
+        names[id] = name
+        self.setText(names, [self.descr(i) for i in range(self.n)])
+
+    def canwrite(self, id):
+        return (self.flags[id] & SW_CANWRITE) != 0
+
+    def min(self, id):
+        return num(self.minv[id])
+
+    def max(self, id):
+        return num(self.maxv[id])
+
+    def step(self, id):
+        return num(self.stepv[id])
@@ -0,0 +1,156 @@
+import network
+import uasyncio
+import utime
+from mipyalpaca.alpacalog import log
+from mipyalpaca.alpacaboot import boot
+
+
+# WLAN connection states
+WLAN_DOWN = "down"              # no link
+WLAN_CONNECTING = "connecting"  # connection attempt running
+WLAN_UP = "up"                  # link is up (station connected or access point active)
+
+# connect failures that do not resolve by waiting longer (ports without these constants never report them)
+_STAT_FAILED = (getattr(network, "STAT_WRONG_PASSWORD", -3), getattr(network, "STAT_NO_AP_FOUND", -2),
+                getattr(network, "STAT_CONNECT_FAIL", -1))
+
+
+# WLAN supervisor task
+# connects in station mode (or activates the access point) without busy waiting,
+# watches the link and reconnects with exponential backoff after a link loss
+class WlanSupervisor:
+
+    def __init__(self, ssid, password, ap_mode=False, config=None):
+        if config is None:
+            config = {}
+        self.ssid = ssid
+        self.password = password
+        self.apMode = ap_mode
+        self.wlan = network.WLAN(network.AP_IF if ap_mode else network.STA_IF)
+        self.state = WLAN_DOWN
+        self.connects = 0          # successful connections
+        self.reconnects = 0        # connections after a link loss
+        self.failures = 0          # failed connection attempts
+        self.lastChange = utime.ticks_ms()  # time of last state change
+        self.onConnect = []        # functions called after every (re)connect
+        self.checkInterval = int(config.get("wlanCheckInterval", 2000))    # link check period in ms
+        self.connectTimeout = int(config.get("wlanConnectTimeout", 15000)) # timeout of one connection attempt in ms
+        self.backoffMin = int(config.get("wlanBackoffMin", 1000))          # first retry delay in ms
+        self.backoffMax = int(config.get("wlanBackoffMax", 60000))         # maximum retry delay in ms
+        self.backoff = self.backoffMin
+        self.task = None
+
+
+    # start supervisor task
+    def start(self):
+        if self.task is None:
+            self.task = uasyncio.create_task(self.run())
+
+
+    # set connection state
+    def setState(self, state):
+        if state != self.state:
+            self.state = state
+            self.lastChange = utime.ticks_ms()
+
+
+    # True if link is up
+    def isUp(self):
+        if self.apMode:
+            return self.wlan.active()
+        return self.wlan.isconnected()
+
+
+    # IP address of the interface
+    def ipAddress(self):
+        return self.wlan.ifconfig()[0]
+
+
+    # connection attempt, returns True if the link is up
+    async def connect(self):
+        self.setState(WLAN_CONNECTING)
+        if self.apMode:
+            self.wlan.config(essid=self.ssid, password=self.password)
+            self.wlan.active(True)
+        else:
+            log.info("Connecting to %s", self.ssid)
+            self.wlan.active(True)
+            self.wlan.connect(self.ssid, self.password)
+        t0 = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), t0) < self.connectTimeout:
+            if self.isUp():
+                return True
+            if (not self.apMode) and (self.wlan.status() in _STAT_FAILED):
+                break
+            await uasyncio.sleep_ms(100)
+        if not self.apMode:
+            self.wlan.disconnect()
+        return False
+
+
+    # link is up
+    def connected(self):
+        if self.connects > 0:
+            self.reconnects += 1
+        self.connects += 1
+        self.backoff = self.backoffMin
+        self.setState(WLAN_UP)
+        boot.first("wlan")
+        if self.apMode:
+            log.notice("AccessPoint active, IP address %s", self.ipAddress())
+        else:
+            log.notice("Connected to IP address %s", self.ipAddress())
+        for fct in self.onConnect:
+            try:
+                fct()
+            except Exception as e:
+                # a failing callback (e.g. socket bind) must not end the supervisor
+                log.error("WLAN connect callback failed: %s", repr(e))
+
+
+    # supervisor loop
+    async def run(self):
+        while True:
+            if self.isUp():
+                if self.state != WLAN_UP:
+                    self.connected()
+                await uasyncio.sleep_ms(self.checkInterval)
+                continue
+
+            if self.state == WLAN_UP:
+                log.warning("WLAN link lost")
+                self.setState(WLAN_DOWN)
+
+            if await self.connect():
+                self.connected()
+            else:
+                self.failures += 1
+                self.setState(WLAN_DOWN)
+                log.warning("WLAN connection failed, retry in %d ms", self.backoff)
+                await uasyncio.sleep_ms(self.backoff)
+                self.backoff = min(self.backoff * 2, self.backoffMax)
+
+
+    # connection state as dictionary
+    def status(self):
+        st = {"Mode": "AP" if self.apMode else "STA", "State": self.state, "Connects": self.connects,
+              "Reconnects": self.reconnects, "Failures": self.failures,
+              "StateAge": utime.ticks_diff(utime.ticks_ms(), self.lastChange)}
+        if self.state == WLAN_UP:
+            st["IPAddress"] = self.ipAddress()
+            if not self.apMode:
+                try:
+                    st["RSSI"] = self.wlan.status("rssi")
+                except (ValueError, TypeError, OSError):
+                    pass
+        return st
+
+
+    # connection state in Prometheus text format
+    def metrics(self):
+        yield "# TYPE alpaca_wlan_up gauge\n"
+        yield "alpaca_wlan_up " + ("1" if self.state == WLAN_UP else "0") + "\n"
+        yield "# TYPE alpaca_wlan_reconnects_total counter\n"
+        yield "alpaca_wlan_reconnects_total " + str(self.reconnects) + "\n"
+        yield "# TYPE alpaca_wlan_connect_failures_total counter\n"
+        yield "alpaca_wlan_connect_failures_total " + str(self.failures) + "\n"
@@ -1,28 +1,226 @@
 from mipyalpaca.alpacaswitch import SwitchDevice
+from mipyalpaca.alpacaserver import render_template
+from mipyalpaca.alpacaswitchcfg import num
 from machine import Pin
 from machine import PWM
 from machine import ADC
-from microdot_utemplate import render_template
+import machine
+import utime
+
+
+# Compiled pin handlers of MiPySwitchDevice (one object per "MiPyPin" switch)
+# get: return switch value, getbool: return boolean switch value, set: write value to pin
+# vals is the list of switch values of the device
+# handlers with hw = True access the hardware and are taken over by the hardware worker if enabled
+# handlers with polled = True read memory or a GPIO register and are polled by the change stream
+
+# GPIO output pin
+class OutpPinHandler:
+    __slots__ = ("pin",)
+    hw = True   # accesses hardware (served by the hardware worker)
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def get(self, vals, id):
+        return vals[id]
+
+    def getbool(self, vals, id):
+        return bool(vals[id])
+
+    def set(self, vals, id, value):
+        self.pin.value(value)
+
+
+# GPIO input pin
+class InpPinHandler:
+    __slots__ = ("pin",)
+    hw = True       # accesses hardware (served by the hardware worker)
+    polled = True   # non-blocking read (polled by the change stream)
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def get(self, vals, id):
+        v = vals[id] = self.pin.value()
+        return v
+
+    def getbool(self, vals, id):
+        v = vals[id] = self.pin.value()
+        return bool(v)
+
+    def set(self, vals, id, value):
+        pass
+
+
+# GPIO input pin with interrupt driven state tracking
+# the pin interrupt keeps the current state and edge counters, requests only read memory
+class IrqInpPinHandler:
+    __slots__ = ("pin", "state", "debounced", "counted", "rising", "falling", "edgeTime", "debounce")
+    polled = True   # reads memory (polled by the change stream)
+
+    def __init__(self, pin, debounce):
+        self.pin = pin
+        self.state = pin.value()         # current pin state
+        self.debounced = self.state      # debounced pin state
+        self.counted = self.state        # pin state after the last counted edge
+        self.rising = 0                  # number of rising edges
+        self.falling = 0                 # number of falling edges
+        self.edgeTime = utime.ticks_ms() # time of last edge
+        self.debounce = debounce         # debounce time in ms
+        pin.irq(handler=self.onEdge, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING)
+
+    # pin interrupt handler
+    # edges within the debounce time after the previous edge are contact bounce and not counted
+    def onEdge(self, pin):
+        v = pin.value()
+        t = utime.ticks_ms()
+        if utime.ticks_diff(t, self.edgeTime) >= self.debounce:
+            if v == self.counted:
+                # pulse shorter than interrupt latency: count both edges
+                self.rising += 1
+                self.falling += 1
+            else:
+                self.counted = v
+                if v:
+                    self.rising += 1
+                else:
+                    self.falling += 1
+        self.state = v
+        self.edgeTime = t
+
+    # return debounced state (state is taken over if stable for the debounce time)
+    def read(self):
+        irq = machine.disable_irq()
+        state = self.state
+        t = self.edgeTime
+        machine.enable_irq(irq)
+        if utime.ticks_diff(utime.ticks_ms(), t) >= self.debounce:
+            self.debounced = state
+        return self.debounced
+
+    # return edge counters (rising, falling)
+    def counters(self):
+        irq = machine.disable_irq()
+        c = (self.rising, self.falling)
+        machine.enable_irq(irq)
+        return c
+
+    def get(self, vals, id):
+        v = vals[id] = self.read()
+        return v
+
+    def getbool(self, vals, id):
+        return bool(self.get(vals, id))
+
+    def set(self, vals, id, value):
+        pass
+
+
+# Edge counter of an interrupt driven input pin (read-only, writing sets the counter)
+# the count is kept as int in the pin handler (switch values might be single precision floats),
+# writing only moves the offset of this counter (other counters of the same pin are not changed)
+class EdgeCountHandler:
+    __slots__ = ("src", "edge", "offset")
+    polled = True   # reads memory (polled by the change stream)
+
+    def __init__(self, src, edge):
+        self.src = src     # IrqInpPinHandler of input pin
+        self.edge = edge   # counted edges: "RISING", "FALLING" or "BOTH"
+        self.offset = 0    # pin counter value at count 0
+
+    # return edge count of the pin
+    def edges(self):
+        rising, falling = self.src.counters()
+        if self.edge == "RISING":
+            return rising
+        if self.edge == "FALLING":
+            return falling
+        return rising + falling
+
+    # return exact edge count
+    def count(self):
+        return self.edges() - self.offset
+
+    def get(self, vals, id):
+        v = self.count()
+        vals[id] = v
+        return v
+
+    def getbool(self, vals, id):
+        return bool(self.get(vals, id))
+
+    def set(self, vals, id, value):
+        self.offset = self.edges() - int(value)
+
+
+# PWM output pin
+class PwmPinHandler:
+    __slots__ = ("pin",)
+    hw = True   # accesses hardware (served by the hardware worker)
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def get(self, vals, id):
+        return vals[id]
+
+    def getbool(self, vals, id):
+        return bool(vals[id])
+
+    def set(self, vals, id, value):
+        self.pin.duty_u16(int(round(value)))
+
+
+# ADC input pin
+class AdcPinHandler:
+    __slots__ = ("pin",)
+    hw = True   # accesses hardware (served by the hardware worker)
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def get(self, vals, id):
+        v = vals[id] = self.pin.read_u16()
+        return v
+
+    def getbool(self, vals, id):
+        return bool(vals[id])
+
+    def set(self, vals, id, value):
+        pass
 
 
 # MicroPython switch device
+# the modules of sampled ADCs, sensors, I/O expanders and the hardware worker are only
+# imported if the switch configuration uses them (shorter boot time)
 # support easy configuration of most common switch functions for MicroPython controllers:
 # - GPIO outputs
 # - GPIO inputs
 # - PWM
 # - ADC
+# - sensors polled by the sensor scheduler
+# - inputs and outputs of I2C I/O expanders (MCP23017, PCF8574)
 class MiPySwitchDevice(SwitchDevice):
     
     def __init__(self, devnr, devname, uniqueid, config_file):
         super().__init__(devnr, devname, uniqueid, config_file)       
         self.description = "MicroPython Alpaca switch device"
         self.swpin = []
+        self.swhandler = []  # compiled pin handler per switch (None for user defined switches)
+        edgecnt = []         # switches with edge counters
+        expports = []        # used I/O expander ports
 
         # configure all MicroPython pins
         for i in range(self.maxswitch):
             sw = self.switchdescr[i]
+            h = None
             
-            if sw["swfct"] == "MiPyPin":
+            if sw["swfct"] == "MiPyPin" and sw["pincfg"]["pinfct"] == "EDGECNT":
+                # edge counter, resolved after all pins are configured
+                edgecnt.append(i)
+
+            elif sw["swfct"] == "MiPyPin":
                 cfg = sw["pincfg"]
                 pnr = int(cfg["pin"])
                 
@@ -34,7 +232,7 @@ class MiPySwitchDevice(SwitchDevice):
                         self.switchValue[i] = int(cfg["initval"])
                         p.init(value=int(cfg["initval"]))
                         p.value(int(cfg["initval"]))
-                    self.swpin.insert(i, p)
+                    h = OutpPinHandler(p)
                     
                 if cfg["pinfct"] == "INP":
                     # input pin
@@ -44,7 +242,11 @@ class MiPySwitchDevice(SwitchDevice):
                         p.init(pull=Pin.PULL_UP)
                     if cfg["pull"] == "PULL_DOWN":
                         p.init(pull=Pin.PULL_DOWN)
-                    self.swpin.insert(i, p)
+                    if cfg.get("irq", False):
+                        # interrupt driven
+                        h = IrqInpPinHandler(p, int(cfg.get("debounce", 0)))
+                    else:
+                        h = InpPinHandler(p)
                     
                 if cfg["pinfct"] == "PWM":
                     # PWM pin
@@ -54,58 +256,108 @@ class MiPySwitchDevice(SwitchDevice):
                         # set initial value
                         self.switchValue[i] = int(cfg["initval"])
                         p.duty_u16(int(cfg["initval"]))                   
-                    self.swpin.insert(i, p)
+                    h = PwmPinHandler(p)
                     
                 if cfg["pinfct"] == "ADC":
                     # ADC pin
-                    p = ADC(Pin(pnr))
-                    self.swpin.insert(i, p)
-            else:
-                self.swpin.insert(i, "UserDef")
+                    if "rate" in cfg:
+                        # sampled in background
+                        from mipyalpaca.mipysampler import AdcSampler
+                        h = AdcSampler.fromConfig(ADC(Pin(pnr)), cfg)
+                    else:
+                        h = AdcPinHandler(ADC(Pin(pnr)))
+
+            elif sw["swfct"] == "Sensor":
+                # polled by the sensor scheduler, measured values are written to switchValue
+                from mipyalpaca.mipysensor import sensors
+                sensors.add(self.switchValue, i, sw["sensorcfg"])
+
+            elif sw["swfct"] == "Expander":
+                # bit of an I/O expander port
+                from mipyalpaca.mipyexpander import expanderHandler
+                h, self.switchValue[i] = expanderHandler(sw["expandercfg"])
+                if h.port not in expports:
+                    expports.append(h.port)
+
+            self.swhandler.append(h)
+            self.swpin.insert(i, sw["swfct"] if h is None else h.pin)
+
+        # configure edge counters
+        for i in edgecnt:
+            cfg = self.switchdescr[i]["pincfg"]
+            src = self.swhandler[int(cfg["src"])]
+            if not isinstance(src, IrqInpPinHandler):
+                raise ValueError("Switch " + str(i) + ": edge counter source must be an interrupt driven input")
+            self.swhandler[i] = EdgeCountHandler(src, cfg.get("edge", "BOTH"))
+            self.swpin[i] = src.pin
+
+        # write direction and initial outputs of the I/O expander ports
+        # (a port whose chip does not answer is configured again on its next access)
+        for port in expports:
+            port.setup()
+
+
+    # hand the hardware switches over to the hardware worker if enabled on the server
+    def installed(self):
+        super().installed()
+        if self.server.config.get("hwWorker", False):
+            from mipyalpaca.mipyworker import hwWorker
+            hwWorker.add(self, self.server.config)
                 
 
     # set switch value
     def setswitchvalue(self, id, value):
-        super().setswitchvalue(id, value)
-        
-        sw = self.switchdescr[id]
-        if sw["swfct"] == "MiPyPin":
-            cfg = sw["pincfg"]
-            if cfg["pinfct"] == "OUTP":
-                self.swpin[id].value(value)
-            if cfg["pinfct"] == "PWM":
-                self.swpin[id].duty_u16(int(round(value)))
+        self.switchValue[id] = value
+        h = self.swhandler[id]
+        if h is not None:
+            h.set(self.switchValue, id, value)
         
 
     # set (boolean) switch value
     def setswitch(self, id, value):
-        self.setswitchvalue(id, value)
+        return self.setswitchvalue(id, value)
+
+
+    # True if the change stream polls switch id: read-only switches whose handler does not
+    # block (inputs, sampled ADCs, edge counters, worker values) and sensors of the scheduler
+    def streamPolled(self, id):
+        if self.swcfg.canwrite(id):
+            return False
+        h = self.swhandler[id]
+        if h is not None:
+            return getattr(h, "polled", False) or (self.swcfg.ttl[id] > 0)
+        return (self.swpin[id] == "Sensor") or super().streamPolled(id)
+
+
+    # value of switch id in the state snapshot (edge counters are saved exactly)
+    def stateValue(self, id):
+        h = self.swhandler[id]
+        if isinstance(h, EdgeCountHandler):
+            return h.count()
+        return super().stateValue(id)
 
 
     # get switch value
     def getswitchvalue(self, id):
-        super().getswitchvalue(id)
-        sw = self.switchdescr[id]
-        if sw["swfct"] == "MiPyPin":
-            cfg = sw["pincfg"]
-            if cfg["pinfct"] == "ADC":
-                self.switchValue[id] = self.swpin[id].read_u16()
-            if cfg["pinfct"] == "INP":
-                self.switchValue[id] = self.swpin[id].value()
-        return self.switchValue[id]
+        h = self.swhandler[id]
+        if h is not None:
+            return num(h.get(self.switchValue, id))
+        return num(self.switchValue[id])
 
 
     # get (boolean) switch value
     def getswitch(self, id):
-        super().getswitch(id)
-        sw = self.switchdescr[id]
-        if sw["swfct"] == "MiPyPin":
-            cfg = sw["pincfg"]
-            if cfg["pinfct"] == "INP":
-                self.switchValue[id] = self.swpin[id].value()
+        h = self.swhandler[id]
+        if h is not None:
+            return h.getbool(self.switchValue, id)
         return bool(self.switchValue[id])
 
 
-    # return setup page
-    def setupRequest(self, request):
+    # render setup page
+    def renderSetupPage(self):
         return render_template('setupswitch0.html', devname=self.name, cfgfile=self.configfile)
+
+    # return setup page (cached, page cache is imported on first use)
+    def setupRequest(self, request):
+        from mipyalpaca.alpacapages import pages
+        return pages.respond(request, "switch/" + str(self.device_nr), self.renderSetupPage)
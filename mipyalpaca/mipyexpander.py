@@ -0,0 +1,245 @@
+import uasyncio
+import utime
+from mipyalpaca.mipysensor import getBus, getI2C
+from mipyalpaca.alpacalog import log
+
+
+# retry delays of a failed latch write in ms (doubled after each failure)
+FLUSH_RETRY_MIN = 50
+FLUSH_RETRY_MAX = 2000
+
+
+# I/O expander ports of MiPySwitchDevice ("Expander" switches)
+# all switches on one port share a port snapshot, refreshed with one bus transaction per
+# snapshot window, and a shadow output latch, written with one bus transaction for all
+# output changes made until the next scheduler pass
+
+# Port of an I/O expander (base class, configure(), readPort() and writePort() are chip specific)
+# bus errors do not fail the requests: a port that could not be configured (chip missing or not yet
+# powered up) is configured again on the next access, a failed read returns the last snapshot
+class ExpanderPort:
+
+    def __init__(self, i2c, addr, port, window):
+        self.i2c = i2c
+        self.addr = addr
+        self.port = port         # port number of the chip
+        self.window = window     # validity of a port snapshot in ms
+        self.olat = 0            # output latch
+        self.inputs = 0          # input bit mask
+        self.pullups = 0         # pull-up bit mask
+        self.snapshot = 0        # last read port value
+        self.readTime = None     # time of the last port read
+        self.dirty = False       # output latch not yet written
+        self.configured = False  # direction, pull-ups and latch have been written to the chip
+        self.autoFlush = True    # write latch by an asyncio task (False: flushed by the hardware worker)
+        self.reads = 0           # port read transactions
+        self.writes = 0          # port write transactions
+        self.writeErrors = 0     # consecutive failed port writes
+        self.readErrors = 0      # consecutive failed port reads
+        self.configErrors = 0    # consecutive failed port configurations
+
+    # add port bit
+    def addBit(self, bit, output, pullup, initval):
+        mask = 1 << bit
+        if output:
+            self.inputs &= ~mask
+            if initval:
+                self.olat |= mask
+            else:
+                self.olat &= ~mask
+        else:
+            self.inputs |= mask
+        if pullup:
+            self.pullups |= mask
+        else:
+            self.pullups &= ~mask
+
+    # write port configuration, returns False if the chip did not answer (retried on next access)
+    def setup(self):
+        try:
+            self.configure()
+        except OSError as e:
+            if self.configErrors == 0:
+                log.error("I/O expander 0x%02x port %d configuration failed: %s", (self.addr, self.port, repr(e)))
+            self.configErrors += 1
+            return False
+        self.configured = True
+        if self.configErrors:
+            log.info("I/O expander 0x%02x port %d configured after %d failed attempts", (self.addr, self.port, self.configErrors))
+            self.configErrors = 0
+        return True
+
+    # return port value (from snapshot if not older than the snapshot window)
+    # the last snapshot is returned if the port cannot be read
+    def read(self):
+        now = utime.ticks_ms()
+        if (self.readTime is None) or (utime.ticks_diff(now, self.readTime) >= self.window):
+            self.readTime = now
+            if (not self.configured) and (not self.setup()):
+                return self.snapshot
+            try:
+                self.snapshot = self.readPort()
+            except OSError as e:
+                if self.readErrors == 0:
+                    log.error("I/O expander 0x%02x port %d read failed: %s", (self.addr, self.port, repr(e)))
+                self.readErrors += 1
+                return self.snapshot
+            self.reads += 1
+            if self.readErrors:
+                log.info("I/O expander 0x%02x port %d read after %d failed reads", (self.addr, self.port, self.readErrors))
+                self.readErrors = 0
+        return self.snapshot
+
+    # set output bit, the port is written at the next scheduler pass
+    def set(self, bit, value):
+        if value:
+            self.olat |= 1 << bit
+        else:
+            self.olat &= ~(1 << bit)
+        if not self.dirty:
+            self.dirty = True
+            if self.autoFlush:
+                uasyncio.create_task(self.flushLater())
+
+    # write latch after the current request, a failed write is retried with increasing delay
+    async def flushLater(self):
+        await uasyncio.sleep_ms(0)
+        delay = FLUSH_RETRY_MIN
+        while self.autoFlush and not self.flush():
+            await uasyncio.sleep_ms(delay)
+            delay = min(2 * delay, FLUSH_RETRY_MAX)
+
+    # write output latch if changed, returns False if the write failed (latch stays dirty)
+    # (a port that is not configured yet is configured, which writes the latch as well)
+    def flush(self):
+        if not self.configured:
+            return self.setup()
+        if self.dirty:
+            try:
+                self.writePort()
+            except OSError as e:
+                if self.writeErrors == 0:
+                    log.error("I/O expander 0x%02x port %d write failed: %s", (self.addr, self.port, repr(e)))
+                self.writeErrors += 1
+                return False
+            self.dirty = False
+            self.writes += 1
+            if self.writeErrors:
+                log.info("I/O expander 0x%02x port %d written after %d failed writes", (self.addr, self.port, self.writeErrors))
+                self.writeErrors = 0
+        return True
+
+
+# Port A (0) or B (1) of a MCP23017 16 bit I/O expander (register bank 0 layout)
+class MCP23017Port(ExpanderPort):
+    IODIR = 0x00
+    GPPU = 0x0C
+    GPIO = 0x12
+    OLAT = 0x14
+
+    # write direction, pull-ups and output latch
+    def configure(self):
+        self.i2c.writeto_mem(self.addr, self.IODIR + self.port, bytes((self.inputs,)))
+        self.i2c.writeto_mem(self.addr, self.GPPU + self.port, bytes((self.pullups,)))
+        self.dirty = False
+        self.writePort()
+
+    def readPort(self):
+        return self.i2c.readfrom_mem(self.addr, self.GPIO + self.port, 1)[0]
+
+    def writePort(self):
+        self.i2c.writeto_mem(self.addr, self.OLAT + self.port, bytes((self.olat & 0xFF,)))
+
+
+# PCF8574 8 bit quasi-bidirectional I/O expander (inputs are written high)
+class PCF8574Port(ExpanderPort):
+
+    def configure(self):
+        self.dirty = False
+        self.writePort()
+
+    def readPort(self):
+        return self.i2c.readfrom(self.addr, 1)[0]
+
+    def writePort(self):
+        self.i2c.writeto(self.addr, bytes(((self.olat | self.inputs) & 0xFF,)))
+
+
+# supported chips: name -> (port class, number of ports)
+CHIPS = {"MCP23017": (MCP23017Port, 2), "PCF8574": (PCF8574Port, 1)}
+
+
+# return shared expander port for an "expandercfg" switch configuration
+def getPort(cfg):
+    chip = cfg["chip"]
+    if chip not in CHIPS:
+        raise ValueError("Unknown I/O expander " + chip)
+    cls, nports = CHIPS[chip]
+    port = cfg.get("port", 0)
+    if isinstance(port, str):
+        port = ord(port.upper()) - ord("A")
+    if port < 0 or port >= nports:
+        raise ValueError(chip + ": invalid port " + str(cfg.get("port")))
+    i2c = getI2C(cfg)
+    addr = int(cfg["addr"])
+    return getBus(("expander", int(cfg.get("i2c", 0)), addr, port),
+                  lambda: cls(i2c, addr, port, int(cfg.get("snapshot", 20))))
+
+
+# Expander output bit
+class ExpanderOutpHandler:
+    __slots__ = ("port", "bit", "invert", "pin")
+    hw = True   # accesses hardware (served by the hardware worker)
+
+    def __init__(self, port, bit, invert, pin):
+        self.port = port
+        self.bit = bit
+        self.invert = invert
+        self.pin = pin
+
+    def get(self, vals, id):
+        return vals[id]
+
+    def getbool(self, vals, id):
+        return bool(vals[id])
+
+    def set(self, vals, id, value):
+        self.port.set(self.bit, (1 if value else 0) ^ self.invert)
+
+
+# Expander input bit
+class ExpanderInpHandler:
+    __slots__ = ("port", "bit", "invert", "pin")
+    hw = True   # accesses hardware (served by the hardware worker)
+
+    def __init__(self, port, bit, invert, pin):
+        self.port = port
+        self.bit = bit
+        self.invert = invert
+        self.pin = pin
+
+    def get(self, vals, id):
+        v = vals[id] = ((self.port.read() >> self.bit) & 1) ^ self.invert
+        return v
+
+    def getbool(self, vals, id):
+        return bool(self.get(vals, id))
+
+    def set(self, vals, id, value):
+        pass
+
+
+# create handler for an "expandercfg" switch configuration, returns (handler, initial value)
+def expanderHandler(cfg):
+    port = getPort(cfg)
+    bit = int(cfg["bit"])
+    if bit < 0 or bit > 7:
+        raise ValueError(cfg["chip"] + ": invalid bit " + str(bit))
+    invert = 1 if cfg.get("invert", False) else 0
+    label = cfg["chip"] + " " + hex(port.addr) + " " + "AB"[port.port] + str(bit)
+    if cfg.get("pinfct", "OUTP") == "OUTP":
+        initval = int(cfg.get("initval") or 0)
+        port.addBit(bit, True, False, initval ^ invert)
+        return ExpanderOutpHandler(port, bit, invert, label), initval
+    port.addBit(bit, False, cfg.get("pull") == "PULL_UP", 0)
+    return ExpanderInpHandler(port, bit, invert, label), 0
@@ -0,0 +1,97 @@
+import uasyncio
+from array import array
+
+
+# ADC filter modes
+ADC_FILTER_NONE = 0     # latest sample
+ADC_FILTER_AVG = 1      # moving average over ring buffer
+ADC_FILTER_MEDIAN = 2   # median of ring buffer
+
+AdcFilterModes = {"none": ADC_FILTER_NONE, "avg": ADC_FILTER_AVG, "median": ADC_FILTER_MEDIAN}
+
+
+# Background ADC sampler (pin handler of MiPySwitchDevice for sampled "ADC" pins)
+# samples the ADC in an asyncio task and publishes the latest filtered value,
+# so switch requests never touch the peripheral
+class AdcSampler:
+    __slots__ = ("pin", "period", "oversample", "mode", "ring", "scratch", "idx", "count", "sum", "value", "task")
+    polled = True   # reads memory (polled by the change stream)
+
+    def __init__(self, adc, rate, oversample=1, mode=ADC_FILTER_AVG, size=8):
+        self.pin = adc                        # ADC object
+        self.period = max(1, 1000 // rate)    # sample period in ms
+        self.oversample = max(1, oversample)  # ADC reads per sample
+        self.mode = mode                      # filter mode
+        self.ring = array("H", bytes(2 * size))     # ring buffer of samples
+        self.scratch = array("H", bytes(2 * size))  # work buffer for median filter
+        self.idx = 0                          # next write position in ring buffer
+        self.count = 0                        # number of valid samples in ring buffer
+        self.sum = 0                          # sum of valid samples (moving average)
+        self.value = 0                        # latest filtered value
+        self.sample()
+        self.task = uasyncio.create_task(self.run())
+
+
+    # create sampler from switch pin configuration
+    @classmethod
+    def fromConfig(cls, adc, cfg):
+        return cls(adc, int(cfg["rate"]), int(cfg.get("oversample", 1)),
+                   AdcFilterModes[cfg.get("filter", "avg")], int(cfg.get("bufsize", 8)))
+
+
+    # take one (oversampled) sample and update filtered value
+    def sample(self):
+        s = 0
+        for _ in range(self.oversample):
+            s += self.pin.read_u16()
+        v = s // self.oversample
+
+        ring = self.ring
+        size = len(ring)
+        if self.count < size:
+            self.count += 1
+        else:
+            self.sum -= ring[self.idx]
+        ring[self.idx] = v
+        self.sum += v
+        self.idx = (self.idx + 1) % size
+
+        if self.mode == ADC_FILTER_AVG:
+            self.value = self.sum // self.count
+        elif self.mode == ADC_FILTER_MEDIAN:
+            self.value = self.median()
+        else:
+            self.value = v
+
+
+    # median of valid samples (insertion sort into preallocated work buffer)
+    def median(self):
+        n = self.count
+        buf = self.scratch
+        ring = self.ring
+        for i in range(n):
+            v = ring[i]
+            j = i
+            while j > 0 and buf[j - 1] > v:
+                buf[j] = buf[j - 1]
+                j -= 1
+            buf[j] = v
+        return buf[n // 2]
+
+
+    # sampling task
+    async def run(self):
+        while True:
+            await uasyncio.sleep_ms(self.period)
+            self.sample()
+
+
+    def get(self, vals, id):
+        v = vals[id] = self.value
+        return v
+
+    def getbool(self, vals, id):
+        return bool(self.value)
+
+    def set(self, vals, id, value):
+        pass
@@ -0,0 +1,266 @@
+import uasyncio
+import utime
+from machine import Pin, ADC, I2C
+from mipyalpaca.alpacalog import log
+
+
+# Sensor drivers of the sensor scheduler (one object per "Sensor" switch)
+# start(): start conversion (sensors without bus), read(): return measured value
+# sensors with a bus (bus != None) share one conversion per bus and scheduler cycle
+
+# shared buses: key -> bus object
+_buses = {}
+
+# return shared bus for key, created by factory() on first use
+def getBus(key, factory):
+    bus = _buses.get(key)
+    if bus is None:
+        bus = _buses[key] = factory()
+    return bus
+
+
+# I2C bus by number, configured by "i2c", "scl" and "sda" of a switch config (shared by all users of the bus)
+def getI2C(cfg):
+    busnr = int(cfg.get("i2c", 0))
+    return getBus(("i2c", busnr), lambda: I2C(busnr, scl=Pin(int(cfg["scl"])), sda=Pin(int(cfg["sda"])),
+                                              freq=int(cfg.get("freq", 400000))))
+
+
+# 1-Wire bus with DS18X20 temperature sensors
+class OneWireBus:
+
+    def __init__(self, pnr):
+        from onewire import OneWire
+        from ds18x20 import DS18X20
+        self.pnr = pnr
+        self.ds = DS18X20(OneWire(Pin(pnr)))
+        self.roms = self.ds.scan()   # sensors found on the bus
+        self.rescan = False          # scan the bus again before the next conversion (sensor missing)
+
+    # start temperature conversion of all sensors on the bus
+    def start(self):
+        if self.rescan:
+            self.roms = self.ds.scan()
+            self.rescan = False
+        try:
+            self.ds.convert_temp()
+        except Exception:
+            # no sensor answered the reset: scan again in the next cycle
+            self.rescan = True
+            raise
+
+
+# DS18X20 temperature sensor, selected by "rom" (hex string) or "index" of the bus scan
+class DS18X20Sensor:
+    convdelay = 750   # default conversion time in ms
+
+    def __init__(self, cfg):
+        pnr = int(cfg["pin"])
+        self.bus = getBus(("onewire", pnr), lambda: OneWireBus(pnr))
+        self.idx = int(cfg.get("index", 0))
+        self.rom = None
+        if "rom" in cfg:
+            self.rom = bytes.fromhex(cfg["rom"])
+        elif not self.find():
+            # sensor is searched again by the scheduler, the switch keeps its initial value meanwhile
+            log.error("DS18X20 sensor %d not found on pin %d", (self.idx, pnr))
+            self.bus.rescan = True
+
+    # take sensor from the last bus scan
+    def find(self):
+        if self.idx < len(self.bus.roms):
+            self.rom = self.bus.roms[self.idx]
+            return True
+        return False
+
+    def start(self):
+        pass
+
+    def read(self):
+        if self.rom is None:
+            if not self.find():
+                self.bus.rescan = True
+                raise OSError("DS18X20 sensor " + str(self.idx) + " not found on pin " + str(self.bus.pnr))
+            log.info("DS18X20 sensor %d found on pin %d", (self.idx, self.bus.pnr))
+        return self.bus.ds.read_temp(self.rom)
+
+
+# ADC input, value = raw * "scale" + "offset"
+class AdcSensor:
+    convdelay = 0
+    bus = None
+
+    def __init__(self, cfg):
+        self.adc = ADC(Pin(int(cfg["pin"])))
+        self.scale = float(cfg.get("scale", 1))
+        self.offset = float(cfg.get("offset", 0))
+
+    def start(self):
+        pass
+
+    def read(self):
+        return self.adc.read_u16() * self.scale + self.offset
+
+
+# I2C register sensor: reads "nbytes" (big endian) from register "reg" of device "addr"
+# optional conversion start by writing "startval" to register "startreg"
+# value = raw * "scale" + "offset", "signed" for two's complement values
+class I2CRegSensor:
+    convdelay = 0
+    bus = None
+
+    def __init__(self, cfg):
+        self.i2c = getI2C(cfg)
+        self.addr = int(cfg["addr"])
+        self.reg = int(cfg["reg"])
+        self.nbytes = int(cfg.get("nbytes", 2))
+        self.signed = cfg.get("signed", False)
+        self.scale = float(cfg.get("scale", 1))
+        self.offset = float(cfg.get("offset", 0))
+        self.startreg = cfg.get("startreg")
+        if self.startreg is not None:
+            self.startval = bytes([int(cfg.get("startval", 1))])
+
+    def start(self):
+        if self.startreg is not None:
+            self.i2c.writeto_mem(self.addr, int(self.startreg), self.startval)
+
+    def read(self):
+        raw = int.from_bytes(self.i2c.readfrom_mem(self.addr, self.reg, self.nbytes), "big")
+        if self.signed and raw >= (1 << (8 * self.nbytes - 1)):
+            raw -= 1 << (8 * self.nbytes)
+        return raw * self.scale + self.offset
+
+
+# scheduled sensor of a switch
+class ScheduledSensor:
+    __slots__ = ("driver", "vals", "id", "interval", "convdelay", "due", "errors")
+
+    def __init__(self, driver, vals, id, interval, convdelay):
+        self.driver = driver        # sensor driver
+        self.vals = vals            # switch values of the device
+        self.id = id                # switch id
+        self.interval = interval    # poll interval in ms
+        self.convdelay = convdelay  # conversion time in ms
+        self.due = utime.ticks_ms() # time of next measurement
+        self.errors = 0             # failed reads
+
+
+# Cooperative scheduler of all sensors ("Sensor" switches)
+# one task polls all sensors, due sensors are converted together and the conversion
+# of sensors on the same bus is started once (sensors on that bus are read in the same cycle)
+class SensorScheduler:
+    # sensor drivers: name -> class(cfg), might be extended by applications
+    drivers = {"DS18X20": DS18X20Sensor, "ADC": AdcSensor, "I2CReg": I2CRegSensor}
+
+    def __init__(self):
+        self.sensors = []   # scheduled sensors
+        self.task = None    # scheduler task
+
+
+    # add sensor for switch id of switch value list vals, cfg is the "sensorcfg" of the switch
+    def add(self, vals, id, cfg):
+        drvcls = SensorScheduler.drivers.get(cfg["driver"])
+        if drvcls is None:
+            raise ValueError("Unknown sensor driver " + cfg["driver"])
+        drv = drvcls(cfg)
+        s = ScheduledSensor(drv, vals, id, int(cfg.get("interval", 2000)), int(cfg.get("convdelay", drv.convdelay)))
+        self.sensors.append(s)
+        if self.task is None:
+            self.task = uasyncio.create_task(self.run())
+        return s
+
+
+    # measure due sensors and the sensors sharing a bus with them
+    async def cycle(self, now):
+        batch = []
+        buses = []
+        for s in self.sensors:
+            if utime.ticks_diff(now, s.due) >= 0:
+                batch.append(s)
+                bus = s.driver.bus
+                if (bus is not None) and (bus not in buses):
+                    buses.append(bus)
+        # piggyback sensors on started buses
+        for s in self.sensors:
+            if (s.driver.bus in buses) and (s not in batch):
+                batch.append(s)
+
+        # start conversions, sensors without conversion time are read at once
+        # (sensors of a failed bus or conversion are rescheduled with an error)
+        failed = []
+        for bus in buses:
+            try:
+                bus.start()
+            except Exception as e:
+                log.error("Sensor bus error: %s", repr(e))
+                failed.append(bus)
+        delay = 0
+        started = []
+        for s in batch:
+            if failed and (s.driver.bus in failed):
+                self.failed(s)
+                continue
+            try:
+                s.driver.start()
+            except Exception as e:
+                log.error("Sensor %d start error: %s", (s.id, repr(e)))
+                self.failed(s)
+                continue
+            if s.convdelay > 0:
+                started.append(s)
+                if s.convdelay > delay:
+                    delay = s.convdelay
+            else:
+                self.publish(s)
+        if not started:
+            return
+
+        # wait for the slowest conversion
+        await uasyncio.sleep_ms(delay)
+        for s in started:
+            self.publish(s)
+
+
+    # read sensor, write value to switch values and schedule next measurement
+    # (driver exceptions, e.g. 1-Wire CRC errors, are counted and logged, the switch keeps its last value)
+    def publish(self, s):
+        try:
+            s.vals[s.id] = s.driver.read()
+        except Exception as e:
+            log.error("Sensor %d read error: %s", (s.id, repr(e)))
+            s.errors += 1
+        s.due = utime.ticks_add(utime.ticks_ms(), s.interval)
+
+
+    # count failed measurement and schedule next measurement
+    def failed(self, s):
+        s.errors += 1
+        s.due = utime.ticks_add(utime.ticks_ms(), s.interval)
+
+
+    # scheduler task
+    async def run(self):
+        while True:
+            now = utime.ticks_ms()
+            wait = None
+            for s in self.sensors:
+                d = utime.ticks_diff(s.due, now)
+                if (wait is None) or (d < wait):
+                    wait = d
+            if wait > 0:
+                await uasyncio.sleep_ms(wait)
+            else:
+                try:
+                    await self.cycle(now)
+                except Exception as e:
+                    # unexpected failure, the task keeps running and retries after the shortest interval
+                    log.error("Sensor scheduler error: %s", repr(e))
+                    for s in self.sensors:
+                        if utime.ticks_diff(now, s.due) >= 0:
+                            s.errors += 1
+                    await uasyncio.sleep_ms(min(s.interval for s in self.sensors))
+
+
+# sensor scheduler of all switch devices
+sensors = SensorScheduler()
@@ -0,0 +1,270 @@
+import uasyncio
+import utime
+from array import array
+from mipyalpaca.alpacametrics import metrics
+from mipyalpaca.alpacalog import log
+
+try:
+    import _thread    # ports with threads (RP2040: second core)
+except ImportError:
+    _thread = None
+
+
+# Pin handler of a switch served by the hardware worker (replaces the compiled pin handler)
+# reads return the value sampled (inputs) or written (outputs) by the worker, writes are
+# queued for the worker, so requests on core 0 only access memory
+# if the worker thread has ended, the compiled pin handler is used directly
+class WorkerPinHandler:
+    __slots__ = ("worker", "k", "handler", "pin")
+    polled = True   # reads memory (polled by the change stream)
+
+    def __init__(self, worker, k, handler):
+        self.worker = worker
+        self.k = k               # index in the shared state buffer
+        self.handler = handler   # compiled pin handler owned by the worker
+        self.pin = handler.pin
+
+    def get(self, vals, id):
+        if not self.worker.running:
+            return self.worker.release(self.handler).get(vals, id)
+        v = vals[id] = self.worker.value(self.k)
+        return v
+
+    def getbool(self, vals, id):
+        return bool(self.get(vals, id))
+
+    def set(self, vals, id, value):
+        if not self.worker.running:
+            self.worker.release(self.handler).set(vals, id, value)
+        else:
+            self.worker.submit(self.k, value)
+
+
+# Hardware I/O worker
+# a thread (on RP2040 the second core) owns all pin, PWM, ADC and I/O expander accesses
+# of MiPySwitchDevices: it writes queued output values and samples the inputs into a
+# preallocated, lock protected state buffer
+# hardware errors are logged and counted, the worker keeps running: a failed output write is
+# retried in the next cycle and an output value is only taken into the state buffer when written
+class HwWorker:
+
+    def __init__(self):
+        self.period = 10         # cycle period of the worker in ms
+        self.handlers = []       # compiled pin handlers owned by the worker
+        self.sampledIdx = []     # indices of sampled inputs
+        self.ports = []          # I/O expander ports written by the worker
+        self.lock = None         # lock of state buffer and command queue
+        self.values = None       # shared state buffer: latest value per handler
+        self.initVals = []       # value of each handler when taken over
+        self.portOf = []         # I/O expander port of each handler (None: written by set)
+        self.scratch = None      # private values of the worker thread
+        self.cmdVal = None       # queued output value per handler
+        self.pending = None      # 1 if an output value of the handler is queued
+        self.queue = None        # command queue (ring of handler indices)
+        self.work = None         # commands taken from the queue by the worker
+        self.written = None      # 1 if an output is set, but its expander port is not yet written
+        self.unwritten = 0       # number of outputs with written = 1
+        self.head = 0            # next queue entry read by the worker
+        self.tail = 0            # next free queue entry
+        self.task = None         # start task
+        self.running = False
+        self.cycles = 0          # worker cycles
+        self.commands = 0        # executed output commands
+        self.cycleMax = 0        # longest worker cycle in us
+        self.errors = 0          # failed handler accesses and port writes
+        self.failing = False     # last cycle had errors (logged once until the hardware recovers)
+
+
+    # take over the hardware switches of a MiPySwitchDevice (before the server is started)
+    def add(self, dev, config):
+        if _thread is None:
+            raise ValueError("Hardware worker needs _thread")
+        if self.running:
+            raise ValueError("Hardware worker already started")
+        self.period = int(config.get("hwWorkerPeriod", self.period))
+        for id in range(dev.maxswitch):
+            h = dev.swhandler[id]
+            if not getattr(h, "hw", False):
+                continue
+            k = len(self.handlers)
+            self.handlers.append(h)
+            self.initVals.append(dev.switchValue[id])
+            if not dev.swcfg.canwrite(id):
+                self.sampledIdx.append(k)
+            port = getattr(h, "port", None)
+            self.portOf.append(port)
+            if (port is not None) and (port not in self.ports):
+                port.autoFlush = False
+                self.ports.append(port)
+            dev.swhandler[id] = WorkerPinHandler(self, k, h)
+        if self.task is None:
+            self.lock = _thread.allocate_lock()
+            metrics.addSource("hwworker", self.metrics)
+            self.task = uasyncio.create_task(self.start())
+        # the buffers are reallocated while the worker is not yet running
+        n = len(self.handlers)
+        self.values = list(self.initVals)
+        self.scratch = list(self.initVals)
+        self.cmdVal = [0] * n
+        self.pending = bytearray(n)
+        self.queue = array("H", bytes(2 * (n + 1)))
+        self.work = array("H", bytes(2 * n))
+        self.written = bytearray(n)
+        self.head = self.tail = 0
+        for k in self.sampledIdx:
+            try:
+                self.values[k] = self.handlers[k].get(self.values, k)
+            except Exception as e:
+                log.error("Hardware worker: reading switch %s failed: %s", (self.handlers[k].pin, repr(e)))
+
+
+    # start worker thread (when the asyncio loop runs, all devices are installed)
+    async def start(self):
+        self.running = True
+        _thread.start_new_thread(self.run, ())
+
+
+    # return value of handler k from the state buffer
+    def value(self, k):
+        with self.lock:
+            return self.values[k]
+
+
+    # queue output value of handler k, a queued value of the same handler is replaced
+    # (the queue holds each handler at most once and cannot overflow)
+    def submit(self, k, value):
+        with self.lock:
+            self.cmdVal[k] = value
+            self.enqueue(k)
+
+
+    # queue handler k (lock has to be held)
+    def enqueue(self, k):
+        if not self.pending[k]:
+            self.pending[k] = 1
+            self.queue[self.tail] = k
+            self.tail = (self.tail + 1) % len(self.queue)
+
+
+    # compiled pin handler for direct access after the worker thread has ended
+    # (expander ports are flushed by asyncio tasks again)
+    def release(self, h):
+        port = getattr(h, "port", None)
+        if (port is not None) and not port.autoFlush:
+            port.autoFlush = True
+            if port.dirty:
+                uasyncio.create_task(port.flushLater())
+        return h
+
+
+    # count failed hardware access (logged on the first error of a failing period)
+    def error(self, what, e):
+        self.errors += 1
+        if not self.failing:
+            self.failing = True
+            log.error("Hardware worker: " + what + " failed: %s", repr(e))
+
+
+    # worker thread, if it ends the pin handlers are accessed directly again
+    def run(self):
+        try:
+            while self.running:
+                t0 = utime.ticks_us()
+                self.cycle()
+                self.cycles += 1
+                dt = utime.ticks_diff(utime.ticks_us(), t0)
+                if dt > self.cycleMax:
+                    self.cycleMax = dt
+                utime.sleep_ms(self.period)
+        except Exception as e:
+            log.error("Hardware worker stopped: %s", repr(e))
+        finally:
+            self.running = False
+
+
+    # worker cycle: write queued outputs, sample inputs
+    def cycle(self):
+        handlers = self.handlers
+        scratch = self.scratch
+        work = self.work
+        written = self.written
+        errors = self.errors
+
+        # take queued commands
+        n = 0
+        with self.lock:
+            while self.head != self.tail:
+                k = self.queue[self.head]
+                self.head = (self.head + 1) % len(self.queue)
+                self.pending[k] = 0
+                scratch[k] = self.cmdVal[k]
+                work[n] = k
+                n += 1
+
+        # write outputs (failed writes are queued again, unless a newer value is queued)
+        done = 0
+        for i in range(n):
+            k = work[i]
+            try:
+                handlers[k].set(scratch, k, scratch[k])
+            except Exception as e:
+                self.error("writing switch " + str(handlers[k].pin), e)
+                with self.lock:
+                    if not self.pending[k]:
+                        self.cmdVal[k] = scratch[k]
+                        self.enqueue(k)
+                continue
+            if not written[k]:
+                written[k] = 1
+                self.unwritten += 1
+            done += 1
+        for port in self.ports:
+            try:
+                if not port.flush():
+                    self.errors += 1
+            except Exception as e:
+                self.error("writing I/O expander " + hex(port.addr), e)
+        self.commands += done
+
+        # take written outputs into the state buffer (expander outputs when their port is written)
+        if self.unwritten:
+            with self.lock:
+                for k in range(len(handlers)):
+                    if written[k]:
+                        port = self.portOf[k]
+                        if (port is None) or not port.dirty:
+                            self.values[k] = scratch[k]
+                            written[k] = 0
+                            self.unwritten -= 1
+
+        # sample inputs (a failed input keeps its last value)
+        for k in self.sampledIdx:
+            try:
+                handlers[k].get(scratch, k)
+            except Exception as e:
+                self.error("reading switch " + str(handlers[k].pin), e)
+        with self.lock:
+            for k in self.sampledIdx:
+                self.values[k] = scratch[k]
+
+        if self.failing and (self.errors == errors):
+            self.failing = False
+            log.info("Hardware worker: hardware access recovered")
+
+
+    # worker statistics in Prometheus text format
+    def metrics(self):
+        yield "# TYPE alpaca_hwworker_cycles_total counter\n"
+        yield "alpaca_hwworker_cycles_total " + str(self.cycles) + "\n"
+        yield "# TYPE alpaca_hwworker_commands_total counter\n"
+        yield "alpaca_hwworker_commands_total " + str(self.commands) + "\n"
+        yield "# TYPE alpaca_hwworker_cycle_us_max gauge\n"
+        yield "alpaca_hwworker_cycle_us_max " + str(self.cycleMax) + "\n"
+        yield "# TYPE alpaca_hwworker_errors_total counter\n"
+        yield "alpaca_hwworker_errors_total " + str(self.errors) + "\n"
+        yield "# TYPE alpaca_hwworker_running gauge\n"
+        yield "alpaca_hwworker_running " + ("1" if self.running else "0") + "\n"
+
+
+# hardware worker of the MiPySwitchDevices
+hwWorker = HwWorker()
@@ -0,0 +1,22 @@
+# Host-side simulation of the MicroPython environment of MiPyAlpaca
+# install() registers CPython stand-ins for the MicroPython specific modules
+# (machine, network, uasyncio, ujson, utime, onewire, ds18x20, deflate), so that
+# MiPyAlpaca servers can be run and benchmarked under CPython
+
+import sys
+import os
+
+# repository root (contains mipyalpaca, templates and the example configs)
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MODULES = ("machine", "network", "uasyncio", "ujson", "utime", "onewire", "ds18x20", "deflate")
+
+
+# register simulated modules (must be called before mipyalpaca is imported)
+def install():
+    from importlib import import_module
+    for name in _MODULES:
+        if name not in sys.modules:
+            sys.modules[name] = import_module("sim.fake_" + name)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
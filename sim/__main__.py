@@ -0,0 +1,45 @@
+# Run a MiPyAlpaca application under CPython
+# usage: python -m sim [switchExample1.py] [--port PORT] [--discovery-port PORT]
+import argparse
+import json
+import os
+import runpy
+
+import sim
+from sim.flash import SimFlash
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a MiPyAlpaca application in the host simulation")
+    parser.add_argument("app", nargs="?", default="switchExample1.py", help="application script (default switchExample1.py)")
+    parser.add_argument("--port", help="Alpaca server port (default from servercfg.json)")
+    parser.add_argument("--discovery-port", help="discovery port (default from servercfg.json)")
+    args = parser.parse_args()
+
+    sim.install()
+    app = os.path.abspath(os.path.join(sim.REPO_DIR, args.app))
+    flash = SimFlash()
+    flash.mount()
+    configure(args.port, args.discovery_port)
+    try:
+        runpy.run_path(app, run_name="__main__")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flash.unmount()
+
+
+# patch server and discovery port in the simulated servercfg.json
+def configure(port=None, discovery_port=None):
+    with open("servercfg.json") as fp:
+        cfg = json.load(fp)
+    if port:
+        cfg["serverPort"] = str(port)
+    if discovery_port:
+        cfg["discoveryPort"] = str(discovery_port)
+    with open("servercfg.json", "w") as fp:
+        json.dump(cfg, fp)
+
+
+if __name__ == "__main__":
+    main()
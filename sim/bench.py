@@ -0,0 +1,358 @@
+# Load test and benchmark suite for MiPyAlpaca in the host simulation
+# usage: python -m sim.bench [--app switchExample1.py] [--duration 5] [--clients 2] [--switches 32]
+#
+# boots the application on the simulated flash and network, replays NINA-like
+# polling of the switch API, management API requests and UDP discovery, and
+# reports requests/s, latency percentiles and bytes allocated per request
+# and the resident heap of the switch configuration
+import argparse
+import gc
+import asyncio
+import json
+import os
+import runpy
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+import sim
+from sim.flash import SimFlash
+
+
+# return free TCP/UDP port of the host
+def freePort(kind=socket.SOCK_STREAM):
+    s = socket.socket(socket.AF_INET, kind)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+# return percentile p (0..100) of sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# Simulated server running the application in a background thread
+class SimServer:
+
+    def __init__(self, app):
+        self.app = os.path.abspath(os.path.join(sim.REPO_DIR, app))
+        self.port = freePort()
+        self.discoveryPort = freePort(socket.SOCK_DGRAM)
+        self.flash = SimFlash()
+        self.thread = None
+
+    def start(self):
+        from sim.__main__ import configure
+        sim.install()
+        self.flash.mount()
+        configure(self.port, self.discoveryPort)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        # wait until server accepts connections
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("Simulated server did not start")
+
+    def run(self):
+        runpy.run_path(self.app, run_name="__main__")
+
+    def stop(self):
+        self.flash.unmount()
+
+
+# HTTP/1.0 request, returns status code and body
+async def httpRequest(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    req = method + " " + path + " HTTP/1.0\r\nHost: 127.0.0.1\r\n"
+    if body is not None:
+        req += "Content-Type: application/x-www-form-urlencoded\r\nContent-Length: " + str(len(body)) + "\r\n\r\n" + body
+    else:
+        req += "\r\n"
+    writer.write(req.encode())
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), body
+
+
+# request lists of the load scenarios
+def switchPolling(nswitches):
+    # NINA polls connected state and value/state of every switch
+    paths = ["/api/v1/switch/0/connected?ClientID=1&ClientTransactionID=1"]
+    for id in range(nswitches):
+        paths.append("/api/v1/switch/0/getswitchvalue?ClientID=1&ClientTransactionID=1&Id=" + str(id))
+        paths.append("/api/v1/switch/0/getswitch?ClientID=1&ClientTransactionID=1&Id=" + str(id))
+    return paths
+
+
+def switchMetadata(nswitches):
+    paths = ["/api/v1/switch/0/maxswitch?ClientID=1&ClientTransactionID=1",
+             "/api/v1/switch/0/name?ClientID=1&ClientTransactionID=1",
+             "/api/v1/switch/0/driverinfo?ClientID=1&ClientTransactionID=1"]
+    for id in range(nswitches):
+        for method in ("getswitchname", "getswitchdescription", "minswitchvalue", "maxswitchvalue", "switchstep", "canwrite"):
+            paths.append("/api/v1/switch/0/" + method + "?ClientID=1&ClientTransactionID=1&Id=" + str(id))
+    return paths
+
+
+def management(nswitches):
+    return ["/management/apiversions", "/management/v1/description", "/management/v1/configureddevices"]
+
+
+SCENARIOS = (("switch polling", switchPolling), ("switch metadata", switchMetadata), ("management", management))
+
+
+# run HTTP load scenario with concurrent clients, returns (requests, errors, latencies in ms)
+async def runHttpScenario(port, paths, duration, clients):
+    latencies = []
+    errors = [0]
+    end = time.monotonic() + duration
+
+    async def client():
+        i = 0
+        while time.monotonic() < end:
+            path = paths[i % len(paths)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                status, _ = await httpRequest(port, "GET", path)
+                if status != 200:
+                    errors[0] += 1
+            except OSError:
+                errors[0] += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    await asyncio.gather(*[client() for _ in range(clients)])
+    return len(latencies), errors[0], sorted(latencies)
+
+
+# run UDP discovery scenario, returns (requests, errors, latencies in ms)
+def runDiscoveryScenario(port, duration):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.settimeout(0.5)
+    latencies = []
+    errors = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        t0 = time.perf_counter()
+        s.sendto(b"alpacadiscovery1", ("127.0.0.1", port))
+        try:
+            s.recvfrom(128)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        except socket.timeout:
+            errors += 1
+        # stay below the discovery rate limit
+        time.sleep(0.15)
+    s.close()
+    return len(latencies) + errors, errors, sorted(latencies)
+
+
+# dispatch request in-process (no socket), returns the microdot response
+def dispatch(app, method, path, body=None):
+    from microdot import NoCaseDict
+    from microdot_asyncio import Request
+    headers = NoCaseDict()
+    data = b""
+    if body is not None:
+        data = body.encode()
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        headers["Content-Length"] = str(len(data))
+    req = Request(app, ("127.0.0.1", 0), method, path, "1.0", headers, body=data)
+    coro = app.dispatch_request(req)
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+# peak traced heap bytes per call of fct(), averaged over n calls
+def allocPerCall(fct, n=200):
+    fct()
+    tracemalloc.start()
+    total = 0
+    for _ in range(n):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fct()
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / n
+
+
+# run fct() n times, returns mean time per call in us
+def timePerCall(fct, n=5000):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fct()
+    return (time.perf_counter() - t0) * 1000000 / n
+
+
+# switch value access as implemented before the compiled pin handlers
+# (string comparisons on the switch description on every access)
+def legacyGetswitchvalue(dev, descr, id):
+    sw = descr[id]
+    if sw["swfct"] == "MiPyPin":
+        cfg = sw["pincfg"]
+        if cfg["pinfct"] == "ADC":
+            dev.switchValue[id] = dev.swpin[id].read_u16()
+        if cfg["pinfct"] == "INP":
+            dev.switchValue[id] = dev.swpin[id].value()
+    return dev.switchValue[id]
+
+
+# Alpaca reply as built before the reply writer (dict serialized with json)
+def legacyReply(tid, clid, value):
+    return json.dumps({"ServerTransactionID": tid, "ErrorNumber": 0, "ErrorMessage": "",
+                       "ClientTransactionID": clid, "Value": value}).encode()
+
+
+# in-process benchmarks of request dispatch, reply composition and switch access
+def runMicroBenchmarks():
+    from mipyalpaca.alpacaserver import AlpacaServer, alpaca_app, readJson
+    dev = AlpacaServer.devices["switch"][0]
+    descr = readJson(dev.configfile)
+    n = dev.maxswitch
+    results = []
+
+    paths = switchPolling(n) + switchMetadata(n)
+    i = [0]
+
+    def nextRequest():
+        dispatch(alpaca_app, "GET", paths[i[0] % len(paths)])
+        i[0] += 1
+
+    results.append(("dispatch /api/v1 (mixed)", timePerCall(nextRequest, 2000), allocPerCall(nextRequest)))
+
+    writer = AlpacaServer.replyWriter
+    results.append(("reply: ReplyWriter", timePerCall(lambda: writer.reply(1234, 5678, 0, "", 4711)),
+                    allocPerCall(lambda: writer.reply(1234, 5678, 0, "", 4711))))
+    results.append(("reply: dict + json", timePerCall(lambda: legacyReply(1234, 5678, 4711)),
+                    allocPerCall(lambda: legacyReply(1234, 5678, 4711))))
+
+    def handlerAccess():
+        for id in range(n):
+            dev.getswitchvalue(id)
+
+    def legacyAccess():
+        for id in range(n):
+            legacyGetswitchvalue(dev, descr, id)
+
+    results.append(("switch access: pin handlers (all switches)", timePerCall(handlerAccess), allocPerCall(handlerAccess)))
+    results.append(("switch access: legacy (all switches)", timePerCall(legacyAccess), allocPerCall(legacyAccess)))
+    return results
+
+
+# generated switch configuration with n GPIO switches (JSON text)
+def switchConfigJson(n):
+    descr = []
+    for i in range(n):
+        if i % 2:
+            pincfg = {"pin": i % 28, "pinfct": "INP", "pull": "PULL_UP"}
+        else:
+            pincfg = {"pin": i % 28, "pinfct": "OUTP", "initval": 0}
+        descr.append({"switchnr": i, "name": "Switch " + str(i), "pincfg": pincfg, "canwrite": i % 2 == 0,
+                      "min": 0, "max": 1, "step": 1, "swfct": "MiPyPin", "descr": "Relay or input " + str(i)})
+    return json.dumps(descr)
+
+
+# traced heap bytes still allocated by the objects returned by fct()
+def retainedBytes(fct):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    obj = fct()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+# switch metadata as held before the compiled configuration:
+# JSON dicts, value list, deadband list and metadata cache lists
+def legacySwitchConfig(text):
+    from mipyalpaca.alpacajson import ReplyWriter
+    descr = json.loads(text)
+    enc = ReplyWriter().encode
+    values = [0] * len(descr)
+    deadband = [float(sw.get("deadband", 0)) for sw in descr]
+    meta = [[enc(sw[attr]) for sw in descr] for attr in ("name", "descr", "min", "max", "step", "canwrite")]
+    return descr, values, deadband, meta
+
+
+# compiled switch configuration and value array (the JSON dicts are released)
+def compiledSwitchConfig(text):
+    from array import array
+    from mipyalpaca.alpacaswitchcfg import SwitchConfig, FLOAT_TYPE
+    descr = json.loads(text)
+    return SwitchConfig(descr), array(FLOAT_TYPE, [0] * len(descr))
+
+
+# resident heap of the switch configuration of n switches
+def runMemoryBenchmark(n=32):
+    text = switchConfigJson(n)
+    results = []
+    for name, fct in (("JSON dicts + lists + metadata cache", legacySwitchConfig),
+                      ("compiled SwitchConfig + value array", compiledSwitchConfig)):
+        size = retainedBytes(lambda: fct(text))
+        results.append((name, size, size / n))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MiPyAlpaca load test and benchmark suite (host simulation)")
+    parser.add_argument("--app", default="switchExample1.py", help="application script (default switchExample1.py)")
+    parser.add_argument("--duration", type=float, default=5.0, help="duration of each load scenario in s")
+    parser.add_argument("--clients", type=int, default=2, help="number of concurrent HTTP clients")
+    parser.add_argument("--switches", type=int, default=32, help="number of switches of the memory benchmark")
+    parser.add_argument("--json", help="write results to JSON file")
+    args = parser.parse_args()
+    jsonPath = os.path.abspath(args.json) if args.json else None
+
+    server = SimServer(args.app)
+    server.start()
+    from mipyalpaca.alpacaserver import AlpacaServer
+    nswitches = AlpacaServer.devices["switch"][0].maxswitch
+    report = {"load": [], "micro": [], "memory": []}
+
+    print("\n%-28s %8s %8s %8s %8s %8s %8s" % ("scenario", "req", "err", "req/s", "p50 ms", "p90 ms", "p99 ms"))
+    for name, paths in SCENARIOS:
+        count, errors, lat = asyncio.run(runHttpScenario(server.port, paths(nswitches), args.duration, args.clients))
+        report["load"].append((name, count, errors, count / args.duration, percentile(lat, 50), percentile(lat, 90), percentile(lat, 99)))
+    count, errors, lat = runDiscoveryScenario(server.discoveryPort, args.duration)
+    report["load"].append(("discovery (UDP)", count, errors, count / args.duration, percentile(lat, 50), percentile(lat, 90), percentile(lat, 99)))
+    for row in report["load"]:
+        print("%-28s %8d %8d %8.1f %8.2f %8.2f %8.2f" % row)
+
+    print("\n%-44s %12s %14s" % ("in-process benchmark", "us/call", "bytes/call"))
+    report["micro"] = runMicroBenchmarks()
+    for row in report["micro"]:
+        print("%-44s %12.2f %14.0f" % row)
+
+    print("\n%-44s %12s %14s" % ("switch configuration (%d switches)" % args.switches, "heap bytes", "bytes/switch"))
+    report["memory"] = runMemoryBenchmark(args.switches)
+    for row in report["memory"]:
+        print("%-44s %12d %14.0f" % row)
+
+    server.stop()
+    if jsonPath:
+        with open(jsonPath, "w") as fp:
+            json.dump(report, fp, indent=1)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
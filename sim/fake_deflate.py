@@ -0,0 +1,36 @@
+# deflate stand-in (compression side of the MicroPython deflate module) on top of zlib
+import zlib
+
+AUTO = 0
+RAW = 1
+ZLIB = 2
+GZIP = 3
+
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        wbits = wbits or 15
+        if format == RAW:
+            wbits = -wbits
+        elif format == GZIP:
+            wbits += 16
+        self.stream = stream
+        self.closeStream = close
+        self.comp = zlib.compressobj(9, zlib.DEFLATED, wbits)
+
+    def write(self, data):
+        self.stream.write(self.comp.compress(data))
+        return len(data)
+
+    def close(self):
+        if self.comp is not None:
+            self.stream.write(self.comp.flush())
+            self.comp = None
+        if self.closeStream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,169 @@
+# machine stand-in with simulated pins, PWM, ADC and I2C
+# input levels and ADC waveforms can be scripted per pin number
+import math
+import time
+
+
+# scripted input levels: pin number -> value or function(t_ms) returning 0/1
+input_levels = {}
+
+# scripted ADC waveforms: pin number -> function(t_ms) returning 0..65535
+adc_waveforms = {}
+
+
+def _now_ms():
+    return time.monotonic() * 1000
+
+
+# default ADC waveform: 0.2 Hz sine with some noise
+def sine_wave(period_ms=5000, amplitude=20000, offset=32768, noise=500):
+    import random
+
+    def wave(t):
+        v = offset + amplitude * math.sin(2 * math.pi * t / period_ms) + random.uniform(-noise, noise)
+        return max(0, min(65535, int(v)))
+    return wave
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    # all created pins: pin number -> Pin
+    pins = {}
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self.level = 0 if value is None else value
+        self.handler = None
+        self.trigger = 0
+        Pin.pins[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if mode != -1:
+            self.mode = mode
+        if pull != -1:
+            self.pull = pull
+        if value is not None:
+            self.level = value
+
+    def value(self, v=None):
+        if v is None:
+            if self.mode == Pin.OUT:
+                return self.level
+            src = input_levels.get(self.id)
+            if src is None:
+                return self.level
+            return int(src(_now_ms()) if callable(src) else src)
+        self.level = 1 if v else 0
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    # simulate an external level change on an input pin (calls the irq handler)
+    def drive(self, level):
+        old = self.level
+        self.level = 1 if level else 0
+        input_levels.pop(self.id, None)
+        if self.handler is None or old == self.level:
+            return
+        if (self.level and self.trigger & Pin.IRQ_RISING) or (not self.level and self.trigger & Pin.IRQ_FALLING):
+            self.handler(self)
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        pass
+
+
+class ADC:
+    # number of conversions of all ADCs
+    conversions = 0
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+        if self.id not in adc_waveforms:
+            adc_waveforms[self.id] = sine_wave()
+
+    def read_u16(self):
+        ADC.conversions += 1
+        return adc_waveforms[self.id](_now_ms())
+
+
+class I2C:
+    # simulated devices: address -> bytearray of registers
+    devices = {}
+    # number of bus transactions
+    transactions = 0
+
+    def __init__(self, id, scl=None, sda=None, freq=400000):
+        self.id = id
+
+    def scan(self):
+        return list(I2C.devices.keys())
+
+    # registers of device addr (OSError ENODEV like MicroPython if no device answers)
+    def device(self, addr):
+        I2C.transactions += 1
+        dev = I2C.devices.get(addr)
+        if dev is None:
+            raise OSError(19)
+        return dev
+
+    def readfrom(self, addr, n):
+        return bytes(self.device(addr)[:n])
+
+    def writeto(self, addr, buf):
+        self.device(addr)[:len(buf)] = buf
+        return 1
+
+    def readfrom_mem(self, addr, memaddr, n):
+        return bytes(self.device(addr)[memaddr:memaddr + n])
+
+    def writeto_mem(self, addr, memaddr, buf):
+        self.device(addr)[memaddr:memaddr + len(buf)] = buf
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
+
+
+def freq():
+    return 125000000
+
+
+def reset():
+    raise SystemExit("machine.reset()")
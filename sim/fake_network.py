@@ -0,0 +1,66 @@
+# network stand-in, the simulated WLAN uses the host's loopback interface
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+# connection delay of simulated WLAN in ms
+connect_delay = 200
+
+
+class WLAN:
+    # WLAN interfaces: interface id -> WLAN
+    interfaces = {}
+
+    def __new__(cls, interface_id=STA_IF):
+        if interface_id not in WLAN.interfaces:
+            wlan = object.__new__(cls)
+            wlan.id = interface_id
+            wlan._active = False
+            wlan._connect_time = None
+            wlan._config = {}
+            WLAN.interfaces[interface_id] = wlan
+        return WLAN.interfaces[interface_id]
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def connect(self, ssid=None, key=None):
+        self._config["ssid"] = ssid
+        self._connect_time = time.monotonic() + connect_delay / 1000
+
+    def disconnect(self):
+        self._connect_time = None
+
+    # simulate link loss
+    def drop(self):
+        self._connect_time = None
+
+    def isconnected(self):
+        return self._active and self._connect_time is not None and time.monotonic() >= self._connect_time
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -50
+        if self.isconnected():
+            return STAT_GOT_IP
+        if self._connect_time is not None:
+            return STAT_CONNECTING
+        return STAT_IDLE
+
+    def ifconfig(self, cfg=None):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def config(self, *args, **kwargs):
+        self._config.update(kwargs)
+        if args:
+            return self._config.get(args[0])
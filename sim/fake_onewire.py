@@ -0,0 +1,20 @@
+# onewire stand-in
+
+# number of simulated sensors per bus: pin number -> count
+sensors = {}
+
+
+class OneWire:
+    # number of bus transactions
+    transactions = 0
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def scan(self):
+        n = sensors.get(getattr(self.pin, "id", None), 1)
+        return [bytearray(b"\x28\x00\x00\x00\x00\x00\x00" + bytes([i])) for i in range(n)]
+
+    def reset(self, required=False):
+        OneWire.transactions += 1
+        return True
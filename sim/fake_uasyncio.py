@@ -0,0 +1,118 @@
+# uasyncio stand-in on top of CPython asyncio
+import asyncio
+from asyncio import *
+
+# coroutines scheduled by create_task() before the event loop is running
+_pending = []
+
+
+class _StartupTask:
+    def __init__(self, coro):
+        self.coro = coro
+        self.task = None
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+        elif self in _pending:
+            _pending.remove(self)
+            self.coro.close()
+
+    def done(self):
+        return self.task is not None and self.task.done()
+
+
+# MicroPython allows create_task() before the event loop runs
+def create_task(coro):
+    try:
+        return asyncio.get_running_loop().create_task(coro)
+    except RuntimeError:
+        t = _StartupTask(coro)
+        _pending.append(t)
+        return t
+
+
+# start tasks that have been created before the event loop was running
+def _start_pending():
+    while _pending:
+        t = _pending.pop(0)
+        t.task = asyncio.get_running_loop().create_task(t.coro)
+
+
+async def _main(coro):
+    _start_pending()
+    return await coro
+
+
+def run(coro):
+    return asyncio.run(_main(coro))
+
+
+async def sleep_ms(ms):
+    _start_pending()
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._loop = None
+        self._event = asyncio.Event()
+
+    def set(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+        else:
+            self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        self._loop = asyncio.get_running_loop()
+        await self._event.wait()
+        self._event.clear()
+
+
+# poll queue of the MicroPython scheduler, queue_read() returns a future
+# that completes when the socket is readable (to be yielded from an awaitable)
+class _IOQueue:
+    def queue_read(self, sock):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        fd = sock.fileno()
+
+        def ready():
+            loop.remove_reader(fd)
+            if not fut.done():
+                fut.set_result(None)
+
+        def done(f):
+            if f.cancelled():
+                loop.remove_reader(fd)
+
+        loop.add_reader(fd, ready)
+        fut.add_done_callback(done)
+        fut._asyncio_future_blocking = True
+        return fut
+
+    def queue_write(self, sock):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        fd = sock.fileno()
+
+        def ready():
+            loop.remove_writer(fd)
+            if not fut.done():
+                fut.set_result(None)
+
+        loop.add_writer(fd, ready)
+        fut._asyncio_future_blocking = True
+        return fut
+
+
+class core:
+    _io_queue = _IOQueue()
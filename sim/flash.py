@@ -0,0 +1,74 @@
+# Simulated flash file system
+# copies the configuration files and templates into a temporary directory,
+# makes it the working directory and counts write accesses per file
+import builtins
+import os
+import sys
+import shutil
+import tempfile
+
+from sim import REPO_DIR
+
+DEFAULT_FILES = ("servercfg.json", "switch0_expl1.json", "switch0_expl2.json", "templates")
+
+
+class SimFlash:
+
+    def __init__(self, files=DEFAULT_FILES, src=REPO_DIR):
+        self.root = tempfile.mkdtemp(prefix="mipyflash")
+        self.writes = {}          # file name -> number of writes
+        self.bytesWritten = 0     # total bytes written
+        self.origOpen = None
+        for name in files:
+            path = os.path.join(src, name)
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(self.root, name))
+            elif os.path.exists(path):
+                shutil.copy(path, self.root)
+
+
+    # make the flash the working directory and start counting writes
+    def mount(self):
+        os.chdir(self.root)
+        # compiled templates are imported from the flash (MicroPython imports from the working directory)
+        sys.path.insert(0, self.root)
+        self.origOpen = builtins.open
+        flash = self
+
+        class CountingFile:
+            def __init__(self, fp, name):
+                self.fp = fp
+                self.name = name
+
+            def write(self, data):
+                flash.bytesWritten += len(data)
+                return self.fp.write(data)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.fp.close()
+
+            def __getattr__(self, attr):
+                return getattr(self.fp, attr)
+
+        def simOpen(file, mode="r", *args, **kwargs):
+            fp = flash.origOpen(file, mode, *args, **kwargs)
+            if isinstance(file, str) and ("w" in mode or "a" in mode) and not os.path.isabs(file):
+                flash.writes[file] = flash.writes.get(file, 0) + 1
+                return CountingFile(fp, file)
+            return fp
+
+        builtins.open = simOpen
+
+
+    # stop counting writes and remove the temporary directory
+    def unmount(self):
+        if self.origOpen is not None:
+            builtins.open = self.origOpen
+            self.origOpen = None
+        os.chdir(REPO_DIR)
+        if self.root in sys.path:
+            sys.path.remove(self.root)
+        shutil.rmtree(self.root, ignore_errors=True)
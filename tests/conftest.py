@@ -0,0 +1,33 @@
+# Tests run under CPython with the simulated MicroPython modules of sim
+import json
+import pytest
+import sim
+
+sim.install()
+
+
+# switch configuration used by the tests
+SWITCHES = [
+    {"name": "Output", "descr": "Writable switch", "swfct": "UserDef", "min": 0, "max": 100, "step": 1,
+     "canwrite": True},
+    {"name": "Relay", "descr": "Writable on/off switch", "swfct": "UserDef", "min": 0, "max": 1, "step": 1,
+     "canwrite": True},
+    {"name": "Input", "descr": "Read-only switch", "swfct": "UserDef", "min": 0, "max": 1, "step": 1,
+     "canwrite": False},
+]
+
+
+# switch device with the test configuration (config file in a temporary directory)
+@pytest.fixture
+def switchdev(tmp_path, monkeypatch):
+    from mipyalpaca.alpacaswitch import SwitchDevice
+    monkeypatch.chdir(tmp_path)
+    with open("switch.json", "w") as fp:
+        json.dump(SWITCHES, fp)
+    return SwitchDevice(0, "Test switch", "test-uid", "switch.json")
+
+
+# run coroutine to completion
+def run(coro):
+    import uasyncio
+    return uasyncio.run(coro)
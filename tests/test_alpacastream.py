@@ -0,0 +1,79 @@
+import uasyncio
+from conftest import run
+from mipyalpaca.alpacastream import ChangeStream
+
+
+# source of changes with a failing poll
+class FailingSource:
+
+    def __init__(self):
+        self.polls = 0
+
+    def snapshot(self):
+        return []
+
+    def pollChanges(self):
+        self.polls += 1
+        raise ValueError("cannot convert float NaN to integer")
+
+
+# source of changes that publishes on every poll
+class CountingSource:
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.polls = 0
+
+    def snapshot(self):
+        return []
+
+    def pollChanges(self):
+        self.polls += 1
+        self.hub.publish("switch", 0, 0, self.polls)
+
+
+# a failing source is polled again and does not stop the other sources
+def test_poll_failure_keeps_watcher():
+    hub = ChangeStream()
+    hub.pollInterval = 10
+    bad = FailingSource()
+    good = CountingSource(hub)
+    hub.addSource(bad)
+    hub.addSource(good)
+
+    async def main():
+        sub = hub.subscribe()
+        await uasyncio.sleep_ms(55)
+        assert hub.task is not None
+        sub.close()
+        await uasyncio.sleep_ms(30)
+
+    run(main())
+    assert bad.polls >= 3
+    assert good.polls >= 3
+    assert hub.task is None
+
+
+# the watcher task is reset if it ends with an exception, new subscribers start a new one
+def test_watcher_restarts_after_error():
+    hub = ChangeStream()
+    hub.pollInterval = 10
+    src = CountingSource(hub)
+    hub.addSource(src)
+
+    async def main():
+        sub = hub.subscribe()
+        await uasyncio.sleep_ms(5)
+        hub.task.cancel()
+        await uasyncio.sleep_ms(5)
+        assert hub.task is None
+        sub.close()
+        sub = hub.subscribe()
+        assert hub.task is not None
+        polls = src.polls
+        await uasyncio.sleep_ms(35)
+        assert src.polls > polls
+        sub.close()
+        await uasyncio.sleep_ms(20)
+
+    run(main())
@@ -0,0 +1,57 @@
+import pytest
+from conftest import run
+from mipyalpaca.alpacaserver import CallArgError, RangeError, ALPACA_ERR_INVALID_VALUE
+
+
+# SetSwitchValues: valid values and states are set
+def test_setswitchvalues(switchdev):
+    run(switchdev.actionSetSwitchValues('[{"Id": 0, "Value": 42}, {"Id": 1, "State": "true"}]'))
+    assert switchdev.getswitchvalue(0) == 42
+    assert switchdev.getswitchvalue(1) == 1
+
+
+# SetSwitchValues: a missing Parameters argument is a call error (HTTP 400)
+def test_setswitchvalues_missing(switchdev):
+    with pytest.raises(CallArgError):
+        run(switchdev.actionSetSwitchValues(None))
+
+
+# SetSwitchValues: invalid parameter contents are InvalidValue errors, no switch is set
+@pytest.mark.parametrize("parameters", [
+    'not json',
+    '{"Id": 0, "Value": 1}',
+    '[1, 2]',
+    '[{"Value": 1}]',
+    '[{"Id": "x", "Value": 1}]',
+    '[{"Id": 0, "Value": "high"}]',
+    '[{"Id": 0, "Value": 1}, {"Id": 1, "State": "on"}]',
+    '[{"Id": 0, "Value": 1}, {"Id": 7, "Value": 1}]',
+    '[{"Id": 0, "Value": 1000}]',
+])
+def test_setswitchvalues_invalid(switchdev, parameters):
+    with pytest.raises(RangeError) as e:
+        run(switchdev.actionSetSwitchValues(parameters))
+    assert e.value.errnr == ALPACA_ERR_INVALID_VALUE
+    assert switchdev.getswitchvalue(0) == 0
+
+
+# non-finite switch values are rejected by SetSwitchValue and SetSwitchValues
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+def test_nonfinite_value_rejected(switchdev, value):
+    with pytest.raises(RangeError):
+        switchdev.checkSwitchValue(0, value)
+
+
+@pytest.mark.parametrize("value", ['"nan"', '"inf"', '"-inf"'])
+def test_setswitchvalues_nonfinite(switchdev, value):
+    with pytest.raises(RangeError):
+        run(switchdev.actionSetSwitchValues('[{"Id": 0, "Value": ' + value + '}]'))
+    assert switchdev.getswitchvalue(0) == 0
+
+
+# a stored non-finite value does not fail the getters and the state snapshot
+def test_nonfinite_value_stored(switchdev):
+    switchdev.switchValue[0] = float("nan")
+    assert switchdev.getswitchvalue(0) != switchdev.getswitchvalue(0)
+    assert switchdev.stateValue(0) != switchdev.stateValue(0)
+    run(switchdev.actionGetSwitchValues(None))
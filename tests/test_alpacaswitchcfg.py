@@ -0,0 +1,16 @@
+import math
+from mipyalpaca.alpacaswitchcfg import num
+
+
+# integral values are returned as int, other values unchanged
+def test_num():
+    assert num(3.0) == 3 and type(num(3.0)) is int
+    assert num(2.5) == 2.5
+    assert num(7) == 7
+
+
+# non-finite values are returned unchanged
+def test_num_nonfinite():
+    assert math.isnan(num(float("nan")))
+    assert num(float("inf")) == float("inf")
+    assert num(float("-inf")) == float("-inf")
@@ -0,0 +1,58 @@
+import machine
+from mipyalpaca import mipysensor
+from mipyalpaca.mipyexpander import expanderHandler, MCP23017Port
+
+# MCP23017 register addresses of port A
+IODIR = MCP23017Port.IODIR
+GPIO = MCP23017Port.GPIO
+OLAT = MCP23017Port.OLAT
+
+
+# handlers of one output and one input bit on port A of a MCP23017 at 0x20
+def handlers(monkeypatch):
+    monkeypatch.setattr(machine.I2C, "devices", {})
+    monkeypatch.setattr(mipysensor, "_buses", {})
+    cfg = {"chip": "MCP23017", "scl": 5, "sda": 4, "addr": 0x20, "port": "A"}
+    outp, _ = expanderHandler(dict(cfg, bit=0, pinfct="OUTP"))
+    inp, _ = expanderHandler(dict(cfg, bit=4, pinfct="INP"))
+    outp.port.autoFlush = False
+    return outp, inp
+
+
+# a missing chip does not fail start-up, the port is configured on the next access
+def test_missing_chip_configured_later(monkeypatch):
+    outp, inp = handlers(monkeypatch)
+    port = outp.port
+    assert not port.setup()
+    assert not port.configured
+
+    vals = [0, 0]
+    outp.set(vals, 0, 1)
+    assert not port.flush()
+    assert inp.get(vals, 1) == 0
+
+    machine.I2C.devices[0x20] = bytearray(0x16)
+    assert port.flush()
+    assert port.configured
+    assert machine.I2C.devices[0x20][IODIR] == 0x10
+    assert machine.I2C.devices[0x20][OLAT] == 0x01
+
+
+# a failed read returns the last snapshot instead of raising
+def test_read_error_returns_snapshot(monkeypatch):
+    outp, inp = handlers(monkeypatch)
+    port = inp.port
+    port.window = 0
+    machine.I2C.devices[0x20] = bytearray(0x16)
+    assert port.setup()
+    machine.I2C.devices[0x20][GPIO] = 0x10
+    vals = [0, 0]
+    assert inp.get(vals, 1) == 1
+
+    del machine.I2C.devices[0x20]
+    assert inp.get(vals, 1) == 1
+    assert port.readErrors == 1
+
+    machine.I2C.devices[0x20] = bytearray(0x16)
+    assert inp.get(vals, 1) == 0
+    assert port.readErrors == 0
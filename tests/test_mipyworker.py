@@ -0,0 +1,89 @@
+import json
+import pytest
+import machine
+import uasyncio
+from conftest import run
+from mipyalpaca import mipysensor
+from mipyalpaca.mipyexpander import MCP23017Port
+from mipyalpaca.mipyworker import HwWorker
+
+OLAT = MCP23017Port.OLAT
+GPIO = MCP23017Port.GPIO
+
+
+# MiPySwitchDevice with an output and an input bit of a MCP23017, taken over by a worker
+# (the worker cycles are run by the test instead of the worker thread)
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    from mipyalpaca.mipyalpacaswitch import MiPySwitchDevice
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(machine.I2C, "devices", {0x20: bytearray(0x16)})
+    monkeypatch.setattr(mipysensor, "_buses", {})
+    exp = {"chip": "MCP23017", "scl": 5, "sda": 4, "addr": 0x20, "port": "A"}
+    with open("switch.json", "w") as fp:
+        json.dump([{"name": "Out", "descr": "", "swfct": "Expander", "min": 0, "max": 1, "step": 1,
+                    "canwrite": True, "expandercfg": dict(exp, bit=0, pinfct="OUTP")},
+                   {"name": "In", "descr": "", "swfct": "Expander", "min": 0, "max": 1, "step": 1,
+                    "canwrite": False, "expandercfg": dict(exp, bit=4, pinfct="INP")}], fp)
+    dev = MiPySwitchDevice(0, "Test switch", "test-uid", "switch.json")
+    dev.swhandler[1].port.window = 0
+    w = HwWorker()
+    w.add(dev, {})
+    w.task.cancel()
+    w.running = True
+    return w, dev
+
+
+# an output is reported when it has been written, a bus error does not stop the worker
+def test_output_written_after_bus_error(worker):
+    w, dev = worker
+    chip = machine.I2C.devices.pop(0x20)
+    dev.setswitchvalue(0, 1)
+    w.cycle()
+    assert w.running
+    assert w.errors > 0
+    assert dev.getswitchvalue(0) == 0
+
+    machine.I2C.devices[0x20] = chip
+    chip[GPIO] = 0x10
+    w.cycle()
+    assert chip[OLAT] & 1 == 1
+    assert dev.getswitchvalue(0) == 1
+    assert dev.getswitchvalue(1) == 1
+    assert not w.failing
+
+
+# pin handler whose writes fail
+class FailingHandler:
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def set(self, vals, id, value):
+        raise OSError(5)
+
+
+# a failed write is counted and retried in the next cycle
+def test_handler_error_retried(worker):
+    w, dev = worker
+    h = w.handlers[0]
+    w.handlers[0] = FailingHandler(h.pin)
+    dev.setswitchvalue(0, 1)
+    w.cycle()
+    assert w.errors == 1
+    assert w.pending[0] == 1
+    assert dev.getswitchvalue(0) == 0
+    w.handlers[0] = h
+    w.cycle()
+    assert dev.getswitchvalue(0) == 1
+
+
+# the pin handlers are used directly after the worker thread has ended
+def test_direct_access_after_stop(worker):
+    w, dev = worker
+    w.running = False
+    dev.setswitchvalue(0, 1)
+    assert w.handlers[0].port.autoFlush
+    assert dev.getswitchvalue(0) == 1
+    run(uasyncio.sleep_ms(10))
+    assert machine.I2C.devices[0x20][OLAT] & 1 == 1
@@ -0,0 +1,19 @@
+# MicroPython manifest to freeze MiPyAlpaca into the firmware image
+# frozen modules are executed from flash: no compilation and no heap for the bytecode at boot
+#
+# build (e.g. Pico W):
+#   make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=/path/to/MiPyAlpaca/tools/manifest.py
+#
+# the application script, the templates and the JSON config files stay on the file system
+
+# default modules of the board
+include("$(BOARD_DIR)/manifest.py")
+
+# MiPyAlpaca package
+package("mipyalpaca", base_path="..", opt=2)
+
+# Microdot 1.x and utemplate can be frozen as well (path of the local copies):
+# module("microdot.py", base_path="/path/to/microdot/src")
+# module("microdot_asyncio.py", base_path="/path/to/microdot/src")
+# module("microdot_utemplate.py", base_path="/path/to/microdot/src")
+# package("utemplate", base_path="/path/to/utemplate")
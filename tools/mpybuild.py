@@ -0,0 +1,57 @@
+# Build precompiled MiPyAlpaca modules for the controller
+# compiles mipyalpaca/*.py with mpy-cross into build/mipyalpaca/*.mpy; uploading the
+# .mpy files instead of the sources saves the compilation of all modules at every boot
+#
+# usage: python tools/mpybuild.py [--out build] [--march armv6m] [--opt 2] [--mpy-cross mpy-cross]
+# mpy-cross has to match the MicroPython version of the firmware (pip install mpy-cross==<version>)
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+# repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the mipyalpaca package to .mpy files")
+    parser.add_argument("--out", default=os.path.join(REPO_DIR, "build"), help="output directory (default build)")
+    parser.add_argument("--march", default=None, help="native architecture, e.g. armv6m (RP2040) or xtensawin (ESP32)")
+    parser.add_argument("--opt", type=int, default=2, help="optimisation level 0-3 (default 2: without asserts; 3 drops line numbers)")
+    parser.add_argument("--mpy-cross", dest="mpycross", default="mpy-cross", help="mpy-cross executable")
+    args = parser.parse_args()
+
+    src = os.path.join(REPO_DIR, "mipyalpaca")
+    dst = os.path.join(args.out, "mipyalpaca")
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    os.makedirs(dst)
+
+    nsrc = 0
+    nmpy = 0
+    for name in sorted(os.listdir(src)):
+        if not name.endswith(".py"):
+            continue
+        out = os.path.join(dst, name[:-3] + ".mpy")
+        cmd = [args.mpycross, "-O" + str(args.opt), "-o", out]
+        if args.march:
+            cmd.append("-march=" + args.march)
+        cmd.append(os.path.join(src, name))
+        try:
+            subprocess.run(cmd, check=True)
+        except FileNotFoundError:
+            sys.exit(args.mpycross + " not found (pip install mpy-cross)")
+        except subprocess.CalledProcessError as e:
+            sys.exit("Compiling " + name + " failed (" + str(e.returncode) + ")")
+        nsrc += os.path.getsize(os.path.join(src, name))
+        nmpy += os.path.getsize(out)
+        print(name + " -> " + os.path.relpath(out, REPO_DIR))
+
+    print("%d bytes source, %d bytes bytecode" % (nsrc, nmpy))
+    print("Upload " + os.path.relpath(dst, REPO_DIR) + " as /mipyalpaca (together with templates and the config files)")
+
+
+if __name__ == "__main__":
+    main()